@@ -4,7 +4,7 @@ from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter, ChannelNameRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 from django.core.asgi import get_asgi_application
-from core import routing
+from core import db_slots, routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'asacx.settings')
 # Initialize Django ASGI application early to ensure the AppRegistry
@@ -13,7 +13,7 @@ django_asgi_app = get_asgi_application()
 
 
 application = ProtocolTypeRouter({
-    "http": django_asgi_app,
+    "http": db_slots.DatabaseSlotsMiddleware(django_asgi_app),
     "websocket": AllowedHostsOriginValidator(
         AuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
     ),
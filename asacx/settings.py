@@ -97,8 +97,17 @@ DATABASES = {
         "NAME": "django_db",
         "USER": "django_user",
         "PASSWORD": "django_password",
-        "HOST": "db",
-        "PORT": 5432,
+        # point them to pgbouncer to share a pool of server connections
+        "HOST": os.environ.get("DATABASE_HOST", "db"),
+        "PORT": int(os.environ.get("DATABASE_PORT", "5432")),
+        # daphne runs every request on a thread of its own, keep it at 0 there
+        # and pool in pgbouncer, the workers reuse a single thread
+        "CONN_MAX_AGE": int(os.environ.get("DATABASE_CONN_MAX_AGE", "0")),
+        "CONN_HEALTH_CHECKS": True,
+        # server side cursors do not survive pgbouncer transaction pooling
+        "DISABLE_SERVER_SIDE_CURSORS": strtobool(
+            os.environ.get("DATABASE_TRANSACTION_POOLING", "False")
+        ),
     }
 }
 
@@ -149,15 +158,32 @@ ASGI_APPLICATION = "asacx.asgi.application"
 
 LOGIN_URL = "/login/"
 
+# Redis shards, comma separated. The channel layer and core's own keys use a
+# database of each one and keep everything about a party on the shard of its
+# id. The cache only uses the first one.
+REDIS_HOSTS = os.environ.get("REDIS_HOSTS", "redis://cache:6379").split(",")
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "core.channel_layers.PartyRedisChannelLayer",
+        "CONFIG": {
+            "hosts": [{"address": f"{host}/0"} for host in REDIS_HOSTS],
+        },
+    },
+    # fire and forget fan-out without per member queues, only for groups
+    "pubsub": {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
         "CONFIG": {
-            "hosts": [("cache", 6379)],
+            "hosts": [{"address": host} for host in REDIS_HOSTS],
         },
     },
 }
 
+# Layer of the party_<id> groups and the sockets of the players, "default" or
+# "pubsub". The state machine and party_players_<id> channels always use the
+# default layer, they need its queues.
+PARTY_GROUPS_CHANNEL_LAYER = os.environ.get("PARTY_GROUPS_CHANNEL_LAYER", "default")
+
 STORAGES = {
     "staticfiles": {
         "BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage",
@@ -217,12 +243,81 @@ LOGGING = {
     },
 }
 
+# core keeps no party state in the cache, redis_lock locks need a single host
 CACHES = {
     "default": {
         "BACKEND": "redis_lock.django_cache.RedisCache",
-        "LOCATION": "redis://cache:6379/1",
+        "LOCATION": f"{REDIS_HOSTS[0]}/1",
         "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
     }
 }
 
 IS_CHANNELS_WORKER_MASTER = strtobool(os.environ.get("CHANNELS_WORKER_MASTER", "False"))
+
+REDIS_URLS = [f"{host}/2" for host in REDIS_HOSTS]
+
+# Seconds between batched writes of the buffered answers of a running round.
+ANSWER_BUFFER_FLUSH_INTERVAL = float(
+    os.environ.get("ANSWER_BUFFER_FLUSH_INTERVAL", "2")
+)
+
+# Threads used by core.rendering to render templates off the event loop.
+TEMPLATE_RENDER_WORKERS = int(os.environ.get("TEMPLATE_RENDER_WORKERS", "4"))
+
+# Group messages with bigger html are sent as a reference to a redis key.
+BROADCAST_FRAGMENT_MIN_SIZE = int(
+    os.environ.get("BROADCAST_FRAGMENT_MIN_SIZE", "1024")
+)
+BROADCAST_FRAGMENT_TTL = int(os.environ.get("BROADCAST_FRAGMENT_TTL", "60"))
+BROADCAST_FRAGMENT_CACHE_SIZE = int(
+    os.environ.get("BROADCAST_FRAGMENT_CACHE_SIZE", "128")
+)
+
+# Inbound websocket frames allowed per second and burst for each socket, frames
+# over the limit are coalesced into the latest one or dropped.
+PARTY_SOCKET_RATE = float(os.environ.get("PARTY_SOCKET_RATE", "5"))
+PARTY_SOCKET_BURST = int(os.environ.get("PARTY_SOCKET_BURST", "10"))
+PARTY_SOCKET_COALESCE = strtobool(os.environ.get("PARTY_SOCKET_COALESCE", "True"))
+
+# Parties are spread over this many state machine channels, the channels are
+# balanced between the workers heartbeating every interval. A worker missing
+# its heartbeat for the timeout is considered dead.
+STATE_MACHINE_SHARDS = int(os.environ.get("STATE_MACHINE_SHARDS", "16"))
+STATE_MACHINE_HEARTBEAT_INTERVAL = float(
+    os.environ.get("STATE_MACHINE_HEARTBEAT_INTERVAL", "2")
+)
+STATE_MACHINE_HEARTBEAT_TIMEOUT = float(
+    os.environ.get("STATE_MACHINE_HEARTBEAT_TIMEOUT", "10")
+)
+# Seconds a stopping worker waits for its party transitions before handing
+# them over.
+STATE_MACHINE_DRAIN_TIMEOUT = float(
+    os.environ.get("STATE_MACHINE_DRAIN_TIMEOUT", "5")
+)
+
+# Sockets refresh their presence in a party every interval, a presence not
+# refreshed for the ttl is dropped.
+PRESENCE_HEARTBEAT_INTERVAL = float(
+    os.environ.get("PRESENCE_HEARTBEAT_INTERVAL", "10")
+)
+PRESENCE_TTL = float(os.environ.get("PRESENCE_TTL", "30"))
+
+# Longest sleep between two checks of the round deadlines.
+ROUND_TIMERS_POLL_INTERVAL = float(os.environ.get("ROUND_TIMERS_POLL_INTERVAL", "1"))
+
+# Parties per page of the lobby in the home page.
+LOBBY_PAGE_SIZE = int(os.environ.get("LOBBY_PAGE_SIZE", "20"))
+
+# Seconds a rendered party page fragment is kept, a new party version makes it
+# unreachable before.
+PARTY_FRAGMENT_CACHE_TTL = int(os.environ.get("PARTY_FRAGMENT_CACHE_TTL", "300"))
+
+# Http requests touching the database at once, each holds a connection. Keep it
+# below the connections the pool gives each process, consumers and the state
+# machine share one more.
+DATABASE_HTTP_SLOTS = int(os.environ.get("DATABASE_HTTP_SLOTS", "10"))
+
+# Runs the hottest party reads with a psycopg 3 pool on the event loop
+# instead of the ORM in a thread, see core.async_db.
+ASYNC_DB_ENABLED = strtobool(os.environ.get("ASYNC_DB_ENABLED", "False"))
+ASYNC_DB_POOL_SIZE = int(os.environ.get("ASYNC_DB_POOL_SIZE", "10"))
@@ -23,6 +23,7 @@ urlpatterns = [
     path("__debug__/", include("debug_toolbar.urls")),
     path("admin/", admin.site.urls),
     path("home/", views.Home.as_view(), name="home"),
+    path("metrics/", views.Metrics.as_view(), name="metrics"),
     path("login/", views.Login.as_view(), name="login"),
     path("party/create/", views.CreateParty.as_view(), name="create_party"),
     path("party/<int:party_id>/", views.DetailParty.as_view(), name="detail_party"),
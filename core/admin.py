@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.contrib import admin
 
-from .models import Party, PartyRound, UserRoundAnswer
+from .models import Party, PartyPlayerScore, PartyRound, UserRoundAnswer
 
 
 @admin.register(Party)
@@ -34,3 +34,9 @@ class PartyRoundAdmin(admin.ModelAdmin):
 class UserRoundAnswerAdmin(admin.ModelAdmin):
     list_display = ('id', 'round', 'user', 'field', 'value', 'scored_points', 'saved_at')
     list_filter = ('round', 'user', 'saved_at')
+
+
+@admin.register(PartyPlayerScore)
+class PartyPlayerScoreAdmin(admin.ModelAdmin):
+    list_display = ('id', 'party', 'user', 'score')
+    list_filter = ('party',)
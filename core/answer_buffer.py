@@ -0,0 +1,153 @@
+"""
+Write-behind buffer for the answers typed during a round.
+
+Answers are kept in a redis hash per round, on the shard of its party, and
+flushed to ``UserRoundAnswer`` in batches by every state machine worker.
+Entries are only removed from redis once they are stored in postgres, so
+answers buffered by a crashed worker are flushed on the next
+``flush_pending_rounds``. The flush of a stopped round closes its buffer,
+later answers are rejected instead of changing the values being scored.
+"""
+import asyncio
+import logging
+
+from django.conf import settings
+from redis.exceptions import LockError
+
+from core import models, redis_client
+
+logger = logging.getLogger(__name__)
+
+PENDING_ROUNDS_KEY = "answer_buffer:rounds"
+FLUSH_LOCK_TIMEOUT = 30
+CLOSED_ROUND_TTL = 24 * 60 * 60
+
+# Buffers the answers unless the round was closed.
+BUFFER_ANSWERS_SCRIPT = """
+if redis.call("EXISTS", KEYS[3]) == 1 then
+    return 0
+end
+redis.call("HSET", KEYS[1], unpack(ARGV, 2))
+redis.call("SADD", KEYS[2], ARGV[1])
+return 1
+"""
+
+# Drops the flushed entries unless they were overwritten while flushing, and
+# forgets the round once its buffer is empty.
+DELETE_FLUSHED_SCRIPT = """
+for i = 1, #ARGV - 1, 2 do
+    if redis.call("HGET", KEYS[1], ARGV[i + 1]) == ARGV[i + 2] then
+        redis.call("HDEL", KEYS[1], ARGV[i + 1])
+    end
+end
+if redis.call("HLEN", KEYS[1]) == 0 then
+    redis.call("SREM", KEYS[2], ARGV[1])
+end
+"""
+
+VALUE_MAX_LENGTH = models.UserRoundAnswer._meta.get_field("value").max_length
+
+
+def get_buffer_key(round_id: int) -> str:
+    return f"answer_buffer:round:{round_id}"
+
+
+def get_lock_key(round_id: int) -> str:
+    return f"answer_buffer:lock:{round_id}"
+
+
+def get_closed_key(round_id: int) -> str:
+    return f"answer_buffer:closed:{round_id}"
+
+
+def get_pending_member(party_id: int, round_id: int) -> str:
+    return f"{party_id}:{round_id}"
+
+
+async def buffer_user_answers(party_id, round_id, user_id, answers) -> bool:
+    """Returns False when the round is closed and the answers were dropped."""
+    mapping = {
+        f"{user_id}:{field}": (value or "")[:VALUE_MAX_LENGTH]
+        for field, value in answers
+    }
+    if not mapping:
+        return True
+    connection = redis_client.get_connection(party_id)
+    buffered = await connection.eval(
+        BUFFER_ANSWERS_SCRIPT,
+        3,
+        get_buffer_key(round_id),
+        PENDING_ROUNDS_KEY,
+        get_closed_key(round_id),
+        get_pending_member(party_id, round_id),
+        *[item for pair in mapping.items() for item in pair],
+    )
+    if not buffered:
+        logger.info(f"dropping answers of {user_id=} for closed {round_id=}")
+    return bool(buffered)
+
+
+async def flush_round(party_id, round_id, blocking=True, close=False) -> int:
+    """
+    Stores the buffered answers of the round, with ``close`` no answer is
+    buffered for it afterwards.
+    """
+    connection = redis_client.get_connection(party_id)
+    buffer_key = get_buffer_key(round_id)
+    async with connection.lock(
+        get_lock_key(round_id),
+        timeout=FLUSH_LOCK_TIMEOUT,
+        blocking=blocking,
+        blocking_timeout=FLUSH_LOCK_TIMEOUT,
+    ):
+        if close:
+            # before reading the buffer, nothing can be added once it is read
+            await connection.set(get_closed_key(round_id), 1, ex=CLOSED_ROUND_TTL)
+        buffered = await connection.hgetall(buffer_key)
+        answers = []
+        for key, value in buffered.items():
+            user_id, field = key.split(":", 1)
+            answers.append(
+                models.UserRoundAnswer(
+                    round_id=round_id,
+                    user_id=int(user_id),
+                    field=field,
+                    value=value,
+                )
+            )
+        if answers:
+            await models.UserRoundAnswer.objects.abulk_create(
+                answers,
+                update_conflicts=True,
+                update_fields=["value"],
+                unique_fields=["round", "user", "field"],
+            )
+        flushed = [item for pair in buffered.items() for item in pair]
+        await connection.eval(
+            DELETE_FLUSHED_SCRIPT,
+            2,
+            buffer_key,
+            PENDING_ROUNDS_KEY,
+            get_pending_member(party_id, round_id),
+            *flushed,
+        )
+    if answers:
+        logger.debug(f"flushed {len(answers)} answers of {round_id=}")
+    return len(answers)
+
+
+async def flush_pending_rounds(blocking=True):
+    for connection in redis_client.get_connections():
+        for member in await connection.smembers(PENDING_ROUNDS_KEY):
+            party_id, round_id = map(int, member.split(":"))
+            logger.debug(f"flushing buffered answers of {round_id=}")
+            try:
+                await flush_round(party_id, round_id, blocking=blocking)
+            except LockError:
+                logger.debug(f"{round_id=} is being flushed by another worker")
+
+
+async def flush_periodically():
+    while True:
+        await asyncio.sleep(settings.ANSWER_BUFFER_FLUSH_INTERVAL)
+        await flush_pending_rounds(blocking=False)
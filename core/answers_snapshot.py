@@ -0,0 +1,58 @@
+"""
+Answers of every player of a party, loaded with a single query.
+
+The state machine publishes a snapshot on every round transition and sends
+its key to the party group, so each ``PartyConsumer`` reads its own answers
+from redis instead of querying postgres.
+"""
+import json
+import uuid
+
+from core import redis_client
+
+SNAPSHOT_TTL = 300
+
+
+def get_snapshot_key(party_id: int) -> str:
+    return f"party_answers:{party_id}:{uuid.uuid4().hex}"
+
+
+async def publish(party) -> str:
+    key = get_snapshot_key(party.id)
+    answers_by_user = await party.aget_answers_by_user()
+    if answers_by_user:
+        connection = redis_client.get_connection(party.id)
+        async with connection.pipeline(transaction=True) as pipe:
+            pipe.hset(
+                key,
+                mapping={
+                    user_id: json.dumps(answers)
+                    for user_id, answers in answers_by_user.items()
+                },
+            )
+            pipe.expire(key, SNAPSHOT_TTL)
+            await pipe.execute()
+    return key
+
+
+def get_snapshot_party_id(key: str) -> int:
+    return int(key.split(":")[1])
+
+
+async def get_user_answers(key: str, user_id: int) -> list[dict]:
+    connection = redis_client.get_connection(get_snapshot_party_id(key))
+    answers = await connection.hget(key, user_id)
+    if answers is None:
+        return []
+    return json.loads(answers)
+
+
+def get_round_answers(answers: list[dict], letter: str) -> dict:
+    for round_answers in answers:
+        if round_answers["letter"] == letter:
+            return {
+                field: value
+                for field, value in round_answers.items()
+                if field != "letter"
+            }
+    return {}
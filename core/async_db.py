@@ -0,0 +1,170 @@
+"""
+Read path on the event loop for the hottest party queries.
+
+Django 4.2 runs every async ORM call on a thread. With ``ASYNC_DB_ENABLED``
+these read-only queries go through a psycopg 3 ``AsyncConnectionPool`` instead,
+one pool per event loop, and return the same values as the ORM methods of
+``Party``. Without psycopg 3 installed, or disabled, they fall back to the ORM.
+``check_async_db`` compares both paths and ``bench_async_db`` times them.
+"""
+import asyncio
+import logging
+import weakref
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from core import models
+
+try:
+    from psycopg.conninfo import make_conninfo
+    from psycopg_pool import AsyncConnectionPool
+except ImportError:
+    AsyncConnectionPool = None
+
+logger = logging.getLogger(__name__)
+
+_pools = weakref.WeakKeyDictionary()
+
+CURRENT_ROUND_FIELDS = [
+    field.attname for field in models.PartyRound._meta.concrete_fields
+]
+
+CURRENT_ROUND_SQL = """
+SELECT {fields} FROM {rounds_table}
+WHERE party_id = %s
+ORDER BY started_at DESC
+LIMIT 1
+"""
+
+PLAYERS_SCORES_SQL = """
+SELECT users.username, scores.score
+FROM {scores_table} scores
+JOIN {users_table} users ON users.id = scores.user_id
+WHERE scores.party_id = %s
+ORDER BY scores.score DESC
+"""
+
+ANSWERS_FOR_USER_SQL = """
+SELECT answers.field, answers.value, rounds.letter
+FROM {answers_table} answers
+JOIN {rounds_table} rounds ON rounds.id = answers.round_id
+WHERE answers.user_id = %s AND rounds.party_id = %s {scored_rounds_filter}
+ORDER BY answers.round_id
+"""
+
+
+def is_enabled() -> bool:
+    return settings.ASYNC_DB_ENABLED and AsyncConnectionPool is not None
+
+
+def get_conninfo() -> str:
+    database = settings.DATABASES["default"]
+    return make_conninfo(
+        dbname=database["NAME"],
+        user=database["USER"],
+        password=database["PASSWORD"],
+        host=database["HOST"],
+        port=database["PORT"],
+        # as django does, text would be read as bytes from a SQL_ASCII database
+        client_encoding="UTF8",
+    )
+
+
+async def _open_pool():
+    database = settings.DATABASES["default"]
+    kwargs = {"autocommit": True}
+    if database.get("DISABLE_SERVER_SIDE_CURSORS"):
+        # prepared statements do not survive pgbouncer transaction pooling
+        kwargs["prepare_threshold"] = None
+    pool = AsyncConnectionPool(
+        get_conninfo(),
+        min_size=1,
+        max_size=settings.ASYNC_DB_POOL_SIZE,
+        kwargs=kwargs,
+        open=False,
+    )
+    await pool.open()
+    logger.info(f"async db pool opened, max_size={settings.ASYNC_DB_POOL_SIZE}")
+    return pool
+
+
+async def get_pool():
+    # pools are bound to the loop that opened them, every caller of a loop
+    # waits for the same one
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = asyncio.ensure_future(_open_pool())
+    return await _pools[loop]
+
+
+async def fetch(sql: str, params: list) -> list[tuple]:
+    pool = await get_pool()
+    async with pool.connection() as connection:
+        cursor = await connection.execute(sql, params)
+        return await cursor.fetchall()
+
+
+async def get_current_round(party_id: int) -> models.PartyRound | None:
+    if not is_enabled():
+        return await models.Party(id=party_id).aget_current_round()
+    return await fetch_current_round(party_id)
+
+
+async def get_players_scores(party_id: int) -> dict[str, int]:
+    if not is_enabled():
+        return await models.Party(id=party_id).aget_players_scores()
+    return await fetch_players_scores(party_id)
+
+
+async def get_answers_for_user(
+    party_id: int, user, scored_rounds_only: bool = False
+) -> list[dict]:
+    if not is_enabled():
+        return await models.Party(id=party_id).aget_answers_for_user(
+            user, scored_rounds_only=scored_rounds_only
+        )
+    return await fetch_answers_for_user(party_id, user, scored_rounds_only)
+
+
+async def fetch_current_round(party_id: int) -> models.PartyRound | None:
+    rows = await fetch(
+        CURRENT_ROUND_SQL.format(
+            fields=", ".join(CURRENT_ROUND_FIELDS),
+            rounds_table=models.PartyRound._meta.db_table,
+        ),
+        [party_id],
+    )
+    if not rows:
+        return None
+    return models.PartyRound.from_db("default", CURRENT_ROUND_FIELDS, rows[0])
+
+
+async def fetch_players_scores(party_id: int) -> dict[str, int]:
+    rows = await fetch(
+        PLAYERS_SCORES_SQL.format(
+            scores_table=models.PartyPlayerScore._meta.db_table,
+            users_table=get_user_model()._meta.db_table,
+        ),
+        [party_id],
+    )
+    return dict(rows)
+
+
+async def fetch_answers_for_user(
+    party_id: int, user, scored_rounds_only: bool = False
+) -> list[dict]:
+    rows = await fetch(
+        ANSWERS_FOR_USER_SQL.format(
+            answers_table=models.UserRoundAnswer._meta.db_table,
+            rounds_table=models.PartyRound._meta.db_table,
+            scored_rounds_filter="AND rounds.scored_at IS NOT NULL"
+            if scored_rounds_only
+            else "",
+        ),
+        [user.id, party_id],
+    )
+    return models.group_answers_by_round(
+        {"field": field, "value": value, "round__letter": letter}
+        for field, value, letter in rows
+    )
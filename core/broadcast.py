@@ -0,0 +1,82 @@
+"""
+Group messages whose html is stored once in redis.
+
+channels_redis copies a group message into the queue of every member, big
+fragments are stored once under a content addressed key, on the redis shard of
+the party of the group, and only the key is sent to the group. Consumers of the
+same worker share the fetch through a small LRU.
+"""
+import asyncio
+import collections
+import hashlib
+import logging
+
+from django.conf import settings
+
+from core import metrics, redis_client
+
+logger = logging.getLogger(__name__)
+
+_fragments = collections.OrderedDict()
+_fetching = {}
+
+
+def get_fragment_key(message: str, party_id: int | None = None) -> str:
+    digest = hashlib.sha256(message.encode()).hexdigest()
+    if party_id is None:
+        return f"fragment:{digest}"
+    return f"fragment:{party_id}:{digest}"
+
+
+def get_fragment_party_id(key: str) -> int | None:
+    parts = key.split(":")
+    return int(parts[1]) if len(parts) == 3 else None
+
+
+async def group_send(channel_layer, group: str, event: dict, party_id=None):
+    """
+    Sends the event to the group, ``party_id`` places the fragment on the shard
+    of the party, groups without a party use the first one.
+    """
+    message = event.get("message")
+    if message is None or len(message) < settings.BROADCAST_FRAGMENT_MIN_SIZE:
+        await channel_layer.group_send(group, event)
+        return
+    key = get_fragment_key(message, party_id)
+    connection = redis_client.get_connection(party_id)
+    await connection.set(key, message, ex=settings.BROADCAST_FRAGMENT_TTL)
+    metrics.incr("broadcast_fragments_stored")
+    metrics.incr("broadcast_fragment_bytes_stored", len(message))
+    event = dict(event)
+    del event["message"]
+    event["message_key"] = key
+    await channel_layer.group_send(group, event)
+
+
+async def get_message(event: dict) -> str | None:
+    if "message" in event:
+        return event["message"]
+    key = event["message_key"]
+    if key in _fragments:
+        _fragments.move_to_end(key)
+        metrics.incr("broadcast_fragment_cache_hits")
+        return _fragments[key]
+    if key not in _fetching:
+        _fetching[key] = asyncio.ensure_future(_fetch(key))
+    return await asyncio.shield(_fetching[key])
+
+
+async def _fetch(key: str) -> str | None:
+    try:
+        metrics.incr("broadcast_fragment_fetches")
+        connection = redis_client.get_connection(get_fragment_party_id(key))
+        message = await connection.get(key)
+        if message is None:
+            logger.warning(f"fragment {key} expired before being delivered")
+            return None
+        _fragments[key] = message
+        while len(_fragments) > settings.BROADCAST_FRAGMENT_CACHE_SIZE:
+            _fragments.popitem(last=False)
+        return message
+    finally:
+        del _fetching[key]
@@ -0,0 +1,67 @@
+"""
+Channel layer keeping the groups and channels of a party on one redis shard.
+
+channels_redis hashes group names with crc32 and spreads named channels over
+every host in turn. Party groups (``party_<id>``) and party channels
+(``party_players_<id>``, ``party_new_round_<id>``) are mapped to the shard of
+their party id instead, the same one used by ``core.redis_client``. Per socket
+channels keep the default hashing by process.
+"""
+import re
+
+from channels_redis.core import RedisChannelLayer
+
+from core import redis_client
+
+PARTY_NAME_RE = re.compile(r"^party_(?:[a-z_]+_)?(\d+)$")
+
+
+class _PinnedIndexes:
+    """
+    Index generator of channels_redis that returns a pinned index once.
+    send and receive_single pick their index before awaiting anything, so
+    pinning it right before calling them is safe.
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes
+        self.pinned = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.pinned is not None:
+            index, self.pinned = self.pinned, None
+            return index
+        return next(self.indexes)
+
+
+class PartyRedisChannelLayer(RedisChannelLayer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._send_index_generator = _PinnedIndexes(self._send_index_generator)
+        self._receive_index_generator = _PinnedIndexes(
+            self._receive_index_generator
+        )
+
+    def get_party_index(self, name):
+        match = PARTY_NAME_RE.match(name)
+        if match is None or len(self.hosts) == 1:
+            return None
+        return redis_client.get_shard_index(match.group(1), len(self.hosts))
+
+    def consistent_hash(self, value):
+        if isinstance(value, str):
+            index = self.get_party_index(value)
+            if index is not None:
+                return index
+        return super().consistent_hash(value)
+
+    async def send(self, channel, message):
+        self._send_index_generator.pinned = self.get_party_index(channel)
+        return await super().send(channel, message)
+
+    async def receive_single(self, channel):
+        self._receive_index_generator.pinned = self.get_party_index(channel)
+        return await super().receive_single(channel)
@@ -3,19 +3,43 @@ import collections
 import datetime
 import json
 import logging
+import time
 
-from asgiref.sync import async_to_sync, sync_to_async
 from channels.generic.websocket import AsyncConsumer, AsyncWebsocketConsumer
-from django.db import transaction
-from django.template.loader import render_to_string
-
-from core import forms, models
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from core import (
+    answer_buffer,
+    async_db,
+    answers_snapshot,
+    broadcast,
+    forms,
+    lobby,
+    metrics,
+    models,
+    party_cache,
+    party_start,
+    presence,
+    ratelimit,
+    rendering,
+    round_timers,
+    sharding,
+)
 
 logger = logging.getLogger(__name__)
-STATE_MACHINE_CHANNEL_NAME = "party-state-machine"
 
 
 class PartyConsumerMixin:
+    def get_party_groups_channel_layer(self):
+        # the party groups may live in a pub/sub layer, the point to point
+        # channels always need the queues of the default one
+        return get_channel_layer(settings.PARTY_GROUPS_CHANNEL_LAYER)
+
+    def get_queues_channel_layer(self):
+        return get_channel_layer()
+
     def get_party_group_name(
         self, *, party: models.Party | None = None, party_id: int | None = None
     ) -> str:
@@ -32,18 +56,46 @@ class PartyConsumerMixin:
             return "party_players_%s" % party.id
         return "party_players_%s" % party_id
 
+    def serialize_round(self, party_round: models.PartyRound) -> dict:
+        return {
+            "id": party_round.id,
+            "party_id": party_round.party_id,
+            "letter": party_round.letter,
+            "started_at": party_round.started_at.isoformat(),
+        }
+
+    def deserialize_round(self, data: dict) -> models.PartyRound:
+        return models.PartyRound(
+            id=data["id"],
+            party_id=data["party_id"],
+            letter=data["letter"],
+            started_at=datetime.datetime.fromisoformat(data["started_at"]),
+        )
+
 
 class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
+    channel_layer_alias = settings.PARTY_GROUPS_CHANNEL_LAYER
+
     async def connect(self):
         self.party_id = self.scope["url_route"]["kwargs"]["party_id"]
+        self.stats = collections.Counter()
+        self.rate_limit = ratelimit.TokenBucket(
+            settings.PARTY_SOCKET_RATE, settings.PARTY_SOCKET_BURST
+        )
+        self.pending_frame = None
+        self.pending_frame_task = None
+        self.frame_lock = asyncio.Lock()
+        self.presence_task = None
         user = self.scope["user"]
         await self.accept()
         logger.info(f"player connected to party: {self.party_id} {user.username=}")
 
         self.party_group_name = self.get_party_group_name(party_id=self.party_id)
         await self.channel_layer.group_add(self.party_group_name, self.channel_name)
+        await presence.touch(self.party_id, user.id, self.channel_name)
+        self.presence_task = asyncio.create_task(self.refresh_presence())
 
-        await self.channel_layer.send(
+        await self.get_queues_channel_layer().send(
             self.get_party_player_connected_channel_name(party_id=self.party_id),
             {
                 "hola": "mundo",
@@ -55,11 +107,16 @@ class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
         )
 
         self.party = await models.Party.objects.aget(id=self.party_id)
+        # Kept up to date by the state machine events, the round id is used as
+        # epoch so events about older rounds never replace a newer one.
+        self.current_round = await async_db.get_current_round(self.party_id)
 
-        if not self.party.closed_at:
+        if not self.party.closed_at and await party_start.claim_start_signal(
+            self.party, PartyStateMachine.MAX_WAITING_TIME * 2
+        ):
             logger.info(f"party no finalized yet {self.party_id=} trying to start")
-            await self.channel_layer.send(
-                STATE_MACHINE_CHANNEL_NAME,
+            await self.get_queues_channel_layer().send(
+                sharding.get_state_machine_channel_name(self.party_id),
                 {
                     "type": "event_party_started",
                     "party_name": self.party.name,
@@ -70,14 +127,51 @@ class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
 
     async def receive(self, text_data):
         data = json.loads(text_data)
-        if data["HEADERS"]["HX-Trigger"] == "party_current_answers_form":
-            await self.handle_form_submit(data)
+        if data.get("submit_stop"):
+            # a stop is never coalesced, and carries every field so the
+            # parked keystroke is not applied after it
+            self.pending_frame = None
+            await self.handle_frame(data)
+            return
+        # while a frame is parked every newer frame goes through its slot, a
+        # refill must not let them overtake it
+        if self.pending_frame_task is None and self.rate_limit.consume():
+            await self.handle_frame(data)
+            return
+        if not settings.PARTY_SOCKET_COALESCE:
+            self.count("frames_dropped")
+            return
+        if self.pending_frame is not None:
+            self.count("frames_dropped")
+        self.count("frames_coalesced")
+        self.pending_frame = data
+        if self.pending_frame_task is None:
+            self.pending_frame_task = asyncio.create_task(self.handle_pending_frame())
+
+    async def handle_pending_frame(self):
+        try:
+            # frames parked while the previous one was being handled
+            while self.pending_frame is not None:
+                while not self.rate_limit.consume():
+                    await asyncio.sleep(self.rate_limit.get_wait_time())
+                data, self.pending_frame = self.pending_frame, None
+                if data is not None:
+                    # taken from the slot, it is stored even if the socket closes
+                    await asyncio.shield(self.handle_frame(data))
+        finally:
+            self.pending_frame_task = None
+
+    async def handle_frame(self, data):
+        # a stop may arrive while the parked frame is being handled
+        async with self.frame_lock:
+            if data["HEADERS"]["HX-Trigger"] == "party_current_answers_form":
+                await self.handle_form_submit(data)
 
     async def handle_form_submit(self, form_data):
-        if not await self.party_is_available():
+        if not self.party_is_available():
             logger.info(f"skipping form submit {form_data=} since party is closed")
             return
-        current_round = await self.party.aget_current_round()
+        current_round = self.current_round
         form = forms.CurrentAnswersForm(
             form_data,
             current_round=current_round,
@@ -86,32 +180,76 @@ class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
         self.form = form
         await self.save_form(form, current_round)
         if form.is_valid() and form.cleaned_data["submit_stop"]:
-            await self.channel_layer.send(
-                STATE_MACHINE_CHANNEL_NAME,
+            await self.get_queues_channel_layer().send(
+                sharding.get_state_machine_channel_name(self.party_id),
                 {
                     "type": "event_party_round_stopped",
-                    "party": self.party,
-                    "current_round": current_round,
+                    "party_id": self.party.id,
+                    "round_id": current_round.id,
                 },
             )
             return
-        template_string = render_to_string(
-            "party_current_answers.html",
-            {
-                "party": self.party,
-                "current_round": current_round,
-                "form": form,
-            },
-        )
-        await self.html({"message": template_string})
+        await self.send_changed_fields(form, current_round)
+
+    async def send_changed_fields(self, form, current_round):
+        if getattr(self, "sent_fields_round_id", None) != current_round.id:
+            # the round was rendered from scratch, without any error
+            self.sent_fields_round_id = current_round.id
+            self.sent_fields_errors = {}
+
+        fragments = []
+        for field in form.visible_fields():
+            errors = list(field.errors)
+            if self.sent_fields_errors.get(field.name, []) == errors:
+                continue
+            self.sent_fields_errors[field.name] = errors
+            fragments.append(
+                await rendering.render(
+                    "_current_answer_field.html", {"field": field, "oob": True}
+                )
+            )
+
+        self.count("answers_form_submits")
+        if not fragments:
+            return
+        message = "".join(fragments)
+        self.count("answers_fragments_sent", len(fragments))
+        self.count("answers_fragment_bytes_sent", len(message.encode()))
+        await self.html({"message": message})
+
+    async def refresh_presence(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            await presence.touch(
+                self.party_id, self.scope["user"].id, self.channel_name
+            )
+
+    def count(self, name, value=1):
+        self.stats[name] += value
+        metrics.incr(name, value)
 
     async def html(self, event):
-        await self.send(text_data=event["message"])
+        message = await broadcast.get_message(event)
+        if message is not None:
+            await self.send(text_data=message)
+
+    async def event_party_new_round(self, event):
+        new_round = self.deserialize_round(event["round"])
+        if self.current_round is None or new_round.id >= self.current_round.id:
+            self.current_round = new_round
+        await self.html(event)
 
     async def event_party_round_stopped(self, event):
         logger.info(f"round stopped {self.party_id=}")
-        current_round = await self.party.aget_current_round()
-        template_string = render_to_string(
+        if self.current_round is None or event["round_id"] > self.current_round.id:
+            # missed the new round event, only the database knows about it
+            self.current_round = await async_db.get_current_round(self.party_id)
+        elif event["round_id"] < self.current_round.id:
+            logger.info(f"ignoring stop of an old round {event['round_id']=}")
+            return
+        current_round = self.current_round
+        current_round.closed_at = current_round.closed_at or timezone.now()
+        template_string = await rendering.render(
             "party_current_answers.html",
             {
                 "party": self.party,
@@ -119,8 +257,11 @@ class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
                 "form": forms.CurrentAnswersForm(
                     current_round=current_round,
                     disabled=True,
-                    initial=await current_round.aget_initial_data_for_user(
-                        self.scope["user"]
+                    initial=answers_snapshot.get_round_answers(
+                        await answers_snapshot.get_user_answers(
+                            event["answers_key"], self.scope["user"].id
+                        ),
+                        current_round.letter,
                     ),
                 ),
                 "disabled": True,
@@ -131,12 +272,31 @@ class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
     async def disconnect(self, close_code):
         logger.info(
             "player disconnected from party: "
-            f"{self.party_id} {self.scope['user'].username=}"
+            f"{self.party_id} {self.scope['user'].username=} {dict(self.stats)=}"
+        )
+        if self.pending_frame_task:
+            self.pending_frame_task.cancel()
+        # the parked frame is stored right away instead of waiting for a token
+        data, self.pending_frame = self.pending_frame, None
+        if data is not None:
+            await self.handle_frame(data)
+        await self.channel_layer.group_discard(
+            self.party_group_name, self.channel_name
         )
+        if self.presence_task:
+            self.presence_task.cancel()
+            await presence.leave(
+                self.party_id, self.scope["user"].id, self.channel_name
+            )
+        # after the frame still being handled, if any
+        async with self.frame_lock:
+            if hasattr(self, "form"):
+                await answer_buffer.flush_round(
+                    self.party_id, self.form.current_round.id
+                )
 
-    async def party_is_available(self):
-        current_round = await self.party.aget_current_round()
-        if current_round.closed_at is None:
+    def party_is_available(self):
+        if self.current_round and self.current_round.closed_at is None:
             return True
         return False
 
@@ -147,24 +307,89 @@ class PartyConsumer(AsyncWebsocketConsumer, PartyConsumerMixin):
             if field in dict(models.UserRoundAnswer.FIELD_CHOICES)
         }
 
-        await current_round.save_user_answers(self.scope["user"], data.items())
+        await answer_buffer.buffer_user_answers(
+            current_round.party_id,
+            current_round.id,
+            self.scope["user"].id,
+            data.items(),
+        )
 
     async def event_update_past_answers(self, event):
-        rounds = await self.party.aget_answers_for_user(self.scope["user"])
-        template_string = render_to_string(
+        rounds = await answers_snapshot.get_user_answers(
+            event["answers_key"], self.scope["user"].id
+        )
+        template_string = await rendering.render(
             "party_answers.html", context={"rounds": rounds}
         )
         await self.html({"message": template_string})
 
 
+class LobbyConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        if not self.scope["user"].is_authenticated:
+            await self.close()
+            return
+        await self.accept()
+        await self.channel_layer.group_add(lobby.LOBBY_GROUP_NAME, self.channel_name)
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(
+            lobby.LOBBY_GROUP_NAME, self.channel_name
+        )
+
+    async def html(self, event):
+        message = await broadcast.get_message(event)
+        if message is not None:
+            await self.send(text_data=message)
+
+    async def lobby_party_removed(self, event):
+        if self.scope["user"].id in event["user_ids"]:
+            return
+        party_id = event["party_id"]
+        await self.send(
+            text_data=f'<a id="lobby_party_{party_id}" hx-swap-oob="delete"></a>'
+        )
+
+
 class PartyStateMachine(AsyncConsumer, PartyConsumerMixin):
 
     MAX_WAITING_TIME = 120
+    REVEAL_STEP_SECONDS = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.party_tasks = set()
 
     async def event_party_started(self, event):
+        self.run_in_background(self.start_party(event))
+
+    async def event_party_round_stopped(self, event):
+        self.run_in_background(self.end_round(event["party_id"], event["round_id"]))
+
+    async def event_round_timeout(self, event):
+        self.run_in_background(self.end_round(event["party_id"], event["round_id"]))
+
+    async def event_reveal_finished(self, event):
+        self.run_in_background(self.finish_reveal(event["party_id"]))
+
+    def run_in_background(self, coroutine):
+        # every message of the shard goes through this instance, so the slow
+        # transitions run in the background instead of blocking other parties
+        task = asyncio.create_task(coroutine)
+        self.party_tasks.add(task)
+        sharding.party_tasks.add(task)
+        task.add_done_callback(self.party_task_done)
+
+    def party_task_done(self, task):
+        self.party_tasks.discard(task)
+        sharding.party_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("party failed", exc_info=task.exception())
+
+    async def start_party(self, event):
         party_id = event["party_id"]
         force_start = event.get("force_start", False)
-        party = await self.handle_transaction_wait_players_to_join(party_id)
+        party = await self.wait_players_to_join(party_id)
         if not party and not force_start:
             logger.info("Party already locked so skipping")
             return
@@ -172,38 +397,117 @@ class PartyStateMachine(AsyncConsumer, PartyConsumerMixin):
             party = await models.Party.objects.aget(id=party_id)
         logger.info(f"starting {party_id=}")
 
-        await self.next_round(party)
+        await sharding.register_party(party_id)
+        try:
+            await self.resume(party)
+        finally:
+            await sharding.unregister_party(party_id)
+
+    async def resume(self, party):
+        current_round = await party.aget_current_round()
+        if (
+            current_round
+            and current_round.closed_at is not None
+            and current_round.scored_at is None
+        ):
+            # stopped by a worker that died before scoring it, advancing now
+            # would count it as played and skip its scores
+            logger.info(f"resuming the stop of {current_round.id=}")
+            await self.score_round(party, current_round.id)
+            return
+        await self.advance(party)
 
-        for _ in range(party.max_rounds):
-            try:
-                await asyncio.wait_for(
-                    self.channel_layer.receive(f"party_new_round_{party_id}"),
-                    timeout=party.max_round_duration,
-                )
-            except TimeoutError:
-                logger.info("timeout waiting for new round")
-                await self.channel_layer.group_send(
-                    self.get_party_group_name(party_id=party_id),
-                    {"type": "event_party_round_stopped"},
-                )
-            await self.update_scores(party)
-            await self.next_round(party)
-
-        await self.update_scores(party)
-        logger.info(f"party {party_id} finished")
-
-    @sync_to_async
-    def handle_transaction_wait_players_to_join(self, party_id):
-        # should be sync code since django does not support async transactions
-        with transaction.atomic():
-            for party in models.Party.objects.select_for_update(
-                skip_locked=True
-            ).filter(id=party_id, started_at=None):
-                async_to_sync(self.ensure_players_join)(party)
-                logger.info("all players joined")
-                party.started_at = datetime.datetime.now()
-                party.save()
-                return party
+    async def finish_reveal(self, party_id):
+        await sharding.register_party(party_id)
+        try:
+            party = await models.Party.objects.aget(id=party_id)
+            await self.advance(party)
+        finally:
+            await sharding.unregister_party(party_id)
+
+    async def end_round(self, party_id, round_id):
+        # registered before closing the round, a worker dying once it is
+        # closed leaves the party to be resumed by another one
+        await sharding.register_party(party_id)
+        try:
+            # only the first stop or timeout of a round moves the party forward
+            if not await models.PartyRound.objects.filter(
+                id=round_id, closed_at__isnull=True
+            ).aupdate(closed_at=timezone.now()):
+                logger.info(f"round already closed, skipping stop {round_id=}")
+                return
+            await party_cache.bump(party_id)
+            await round_timers.cancel(party_id, round_id)
+            party = await models.Party.objects.aget(id=party_id)
+            await self.score_round(party, round_id)
+        finally:
+            await sharding.unregister_party(party_id)
+
+    async def score_round(self, party, round_id):
+        answers_key = await self.stop_round(party, round_id)
+        reveal_duration = await self.update_scores(party, round_id, answers_key)
+        await party_cache.bump(party.id)
+        await round_timers.schedule(
+            party.id,
+            round_id,
+            time.time() + reveal_duration,
+            event_type="event_reveal_finished",
+        )
+
+    async def advance(self, party):
+        if await party.aget_played_rounds_count() >= party.max_rounds:
+            party.closed_at = timezone.now()
+            await party.asave(update_fields=["closed_at"])
+            await party_cache.bump(party.id)
+            await lobby.party_closed(party.id)
+            logger.info(f"party {party.id} finished")
+            return
+        current_round = await self.next_round(party)
+        await party_cache.bump(party.id)
+        # a party without a duration has no timeout, only a stop ends its rounds
+        if party.max_round_duration is not None:
+            await round_timers.schedule(
+                party.id,
+                current_round.id,
+                current_round.started_at.timestamp() + party.max_round_duration,
+            )
+
+    async def stop_round(self, party, round_id):
+        """
+        Stores the last answers of the round and publishes them, returns the
+        key of the snapshot, the answers do not change once the round is
+        closed.
+        """
+        await answer_buffer.flush_round(party.id, round_id, close=True)
+        answers_key = await answers_snapshot.publish(party)
+        await self.get_party_groups_channel_layer().group_send(
+            self.get_party_group_name(party=party),
+            {
+                "type": "event_party_round_stopped",
+                "round_id": round_id,
+                "answers_key": answers_key,
+            },
+        )
+        return answers_key
+
+    async def wait_players_to_join(self, party_id):
+        # a short claim instead of a row lock, so waiting for players does not
+        # hold a transaction, a connection or a thread
+        if not await party_start.claim_join(party_id, self.MAX_WAITING_TIME * 2):
+            return None
+        party = await models.Party.objects.filter(id=party_id, started_at=None).afirst()
+        if not party:
+            return None
+        await self.ensure_players_join(party)
+        logger.info("all players joined")
+        party.started_at = timezone.now()
+        if not await models.Party.objects.filter(
+            id=party_id, started_at=None
+        ).aupdate(started_at=party.started_at):
+            return None
+        await party_cache.bump(party_id)
+        await lobby.party_started(party_id)
+        return party
 
     async def ensure_players_join(self, party):
         timeout_task_name = "timeout"
@@ -228,42 +532,48 @@ class PartyStateMachine(AsyncConsumer, PartyConsumerMixin):
             task_done = done.pop()
             if task_done.get_name() == timeout_task_name:
                 logger.info("---- timeout waiting new player to join")
+                receive_task.cancel()
                 break
             player_data = task_done.result()
 
             await party.joined_users.aadd(player_data["user_id"])
+            await lobby.party_joined(party.id, player_data["user_id"])
 
-            current_players = await self.get_connected_players(
-                self.get_party_group_name(party=party)
-            )
+            current_players = await presence.count(party.id)
             msg = f"""<div id="party_content">
                 Esperando Mas Jugadores...
-                Actualmente hay {len(current_players)} jugadores
+                Actualmente hay {current_players} jugadores
             </div>
             """
-            await self.channel_layer.group_send(
+            await self.get_party_groups_channel_layer().group_send(
                 self.get_party_group_name(party=party), {"type": "html", "message": msg}
             )
 
             logger.info(f"player joined {player_data=}")
+        timeout_task.cancel()
 
-    async def update_scores(self, party):
-        current_round = await party.aget_current_or_next_round()
-        all_users_answers = await current_round.close_round_and_calculate_scores()
-        await self.display_all_answers(all_users_answers, current_round, party)
-        await self.channel_layer.group_send(
+    async def update_scores(self, party, round_id, answers_key):
+        current_round = await models.PartyRound.objects.aget(id=round_id)
+        all_users_answers = await current_round.acalculate_scores()
+        reveal_duration = await self.display_all_answers(
+            all_users_answers, current_round, party
+        )
+        await self.get_party_groups_channel_layer().group_send(
             self.get_party_group_name(party=party),
-            {"type": "event_update_past_answers"},
+            {
+                "type": "event_update_past_answers",
+                "answers_key": answers_key,
+            },
         )
-        # TODO: update scores
+        return reveal_duration
 
     async def next_round(self, party):
         next_or_current_round = await party.aget_current_or_next_round()
-        template_string = render_to_string(
+        template_string = await rendering.render(
             "_party_content.html",
             {
                 "party": party,
-                "players_scores": await party.aget_players_scores(),
+                "players_scores": await async_db.get_players_scores(party.id),
                 "current_round": next_or_current_round,
                 "base_template": "base_partial.html",
                 "form": forms.CurrentAnswersForm(
@@ -271,18 +581,17 @@ class PartyStateMachine(AsyncConsumer, PartyConsumerMixin):
                 ),
             },
         )
-        await self.channel_layer.group_send(
+        await broadcast.group_send(
+            self.get_party_groups_channel_layer(),
             self.get_party_group_name(party=party),
-            {"type": "html", "message": template_string},
-        )
-
-    async def get_connected_players(self, group):
-        assert self.channel_layer.valid_group_name(group), "Group name not valid"
-        key = self.channel_layer._group_key(group)
-        connection = self.channel_layer.connection(
-            self.channel_layer.consistent_hash(group)
+            {
+                "type": "event_party_new_round",
+                "message": template_string,
+                "round": self.serialize_round(next_or_current_round),
+            },
+            party_id=party.id,
         )
-        return await connection.zrange(key, 0, -1)
+        return next_or_current_round
 
     async def event_party_join(self, event):
         party_id = event["party_id"]
@@ -296,63 +605,36 @@ class PartyStateMachine(AsyncConsumer, PartyConsumerMixin):
             },
         )
 
-    async def event_display_all_answers(self, event):
-        answers = event["answers"]
-        current_round = event["current_round"]
-        party = event["party"]
-        await self.display_all_answers(answers, current_round, party)
-
     async def display_all_answers(self, answers, current_round, party):
         grouped_answers = collections.defaultdict(list)
 
         for answer in answers:
-            grouped_answers[answer.field].append(
-                {
-                    "value": answer.value,
-                    "scored_points": answer.scored_points,
-                    "username": await sync_to_async(lambda: answer.user.username)(),
-                }
-            )
-
-        times = [0.5] + [2] * len(models.UserRoundAnswer.FIELD_CHOICES)
-
-        for field, _ in models.UserRoundAnswer.FIELD_CHOICES:
-            answers = grouped_answers[field]
-            template_string = render_to_string(
-                "party_current_all_users_answers_modal.html",
-                {
-                    "party": party,
-                    "current_round": current_round,
-                    "answers": answers,
-                    "field": field,
-                    "open": "open",
-                },
-            )
-            await self.channel_layer.group_send(
-                self.get_party_group_name(party=party),
-                {
-                    "type": "html",
-                    "message": template_string,
-                },
-            )
-            await asyncio.sleep(times.pop(0))
+            grouped_answers[answer["field"]].append(answer)
 
-        template_string = render_to_string(
+        # a single message, the client steps through the fields by itself
+        steps = [
+            {
+                "field": field,
+                "answers": grouped_answers[field],
+                "delay": self.REVEAL_STEP_SECONDS,
+            }
+            for field, _ in models.UserRoundAnswer.FIELD_CHOICES
+        ]
+        template_string = await rendering.render(
             "party_current_all_users_answers_modal.html",
-            {"open": ""},
+            {
+                "party": party,
+                "current_round": current_round,
+                "steps": steps,
+            },
         )
-        await self.channel_layer.group_send(
+        await broadcast.group_send(
+            self.get_party_groups_channel_layer(),
             self.get_party_group_name(party=party),
             {
                 "type": "html",
                 "message": template_string,
             },
+            party_id=party.id,
         )
-        await asyncio.sleep(times.pop(0))
-
-    async def event_party_round_stopped(self, event):
-        await self.channel_layer.group_send(
-            self.get_party_group_name(party=event["party"]),
-            {"type": "event_party_round_stopped"},
-        )
-        await self.channel_layer.send(f"party_new_round_{event['party'].id}", {})
+        return sum(step["delay"] for step in steps)
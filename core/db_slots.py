@@ -0,0 +1,46 @@
+"""
+Bounds the threads reaching the database.
+
+Every thread running the ORM holds its own connection. Django runs each http
+request in a ``ThreadSensitiveContext``, so its async ORM calls get a thread
+of their own and connections follow the concurrent requests. Requests are
+admitted through a semaphore of ``DATABASE_HTTP_SLOTS`` slots. Consumers and
+the state machine have no such context, asgiref runs all their ORM calls on a
+single thread per process, so they hold one connection at most. The waits for
+a slot and the connections opened are recorded in ``core.metrics``.
+"""
+import asyncio
+import time
+import weakref
+
+from django.conf import settings
+
+from core import metrics
+
+_slots = weakref.WeakKeyDictionary()
+
+
+def get_slots() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = asyncio.Semaphore(settings.DATABASE_HTTP_SLOTS)
+    return _slots[loop]
+
+
+class DatabaseSlotsMiddleware:
+    """ASGI middleware admitting at most DATABASE_HTTP_SLOTS http requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        queued_at = time.perf_counter()
+        async with get_slots():
+            metrics.observe("db_slot_wait_seconds", time.perf_counter() - queued_at)
+            return await self.app(scope, receive, send)
+
+
+def count_connection(sender, connection, **kwargs):
+    metrics.incr("db_connections_opened")
@@ -0,0 +1,142 @@
+"""
+Parties listed in the home page.
+
+The lobby is an index in redis instead of a query: a sorted set with the
+parties not started yet, one per user with the parties they joined that are
+not closed, and a hash with the names. Every set is scored by party id so
+pages are read newest first with the last id as cursor. The index is updated
+when parties are created, joined, started and closed, and every change is
+pushed to the home pages connected to ``LobbyConsumer``. It is rebuilt from
+the database when the master worker starts, and by the first read finding it
+missing, e.g. after redis restarted empty. It spans every party, so it lives
+on the first redis shard.
+"""
+import logging
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from core import broadcast, models, redis_client, rendering
+
+logger = logging.getLogger(__name__)
+
+LOBBY_GROUP_NAME = "lobby"
+OPEN_PARTIES_KEY = "lobby:open"
+PARTY_NAMES_KEY = "lobby:names"
+BUILT_KEY = "lobby:built"
+REBUILD_LOCK_KEY = "lobby:rebuild"
+REBUILD_LOCK_TIMEOUT = 60
+
+
+def get_user_parties_key(user_id: int) -> str:
+    return f"lobby:user:{user_id}"
+
+
+async def get_page(user_id: int, before: int | None = None, limit: int = None):
+    """
+    Returns the parties available to the user older than ``before`` and the
+    cursor of the next page, None for the last one.
+    """
+    limit = limit or settings.LOBBY_PAGE_SIZE
+    max_score = f"({before}" if before else "+inf"
+    connection = redis_client.get_connection()
+    if not await connection.exists(BUILT_KEY):
+        await rebuild_missing()
+    async with connection.pipeline(transaction=False) as pipe:
+        for key in (OPEN_PARTIES_KEY, get_user_parties_key(user_id)):
+            pipe.zrevrangebyscore(key, max_score, "-inf", start=0, num=limit + 1)
+        open_ids, joined_ids = await pipe.execute()
+    party_ids = sorted({int(party_id) for party_id in open_ids + joined_ids})
+    party_ids = party_ids[::-1][: limit + 1]
+    names = await connection.hmget(PARTY_NAMES_KEY, party_ids) if party_ids else []
+    parties = [
+        {"id": party_id, "name": name}
+        for party_id, name in zip(party_ids[:limit], names)
+    ]
+    next_cursor = party_ids[limit - 1] if len(party_ids) > limit else None
+    return parties, next_cursor
+
+
+async def party_created(party: models.Party):
+    connection = redis_client.get_connection()
+    async with connection.pipeline(transaction=True) as pipe:
+        pipe.hset(PARTY_NAMES_KEY, party.id, party.name)
+        pipe.zadd(OPEN_PARTIES_KEY, {party.id: party.id})
+        await pipe.execute()
+    message = await rendering.render(
+        "_lobby_party.html",
+        {"party": {"id": party.id, "name": party.name}, "oob": True},
+    )
+    await broadcast.group_send(
+        get_channel_layer(), LOBBY_GROUP_NAME, {"type": "html", "message": message}
+    )
+
+
+async def party_joined(party_id: int, user_id: int):
+    connection = redis_client.get_connection()
+    await connection.zadd(get_user_parties_key(user_id), {party_id: party_id})
+
+
+async def party_started(party_id: int):
+    connection = redis_client.get_connection()
+    await connection.zrem(OPEN_PARTIES_KEY, party_id)
+    # the players keep it in their lobby until it is closed
+    user_ids = [
+        user_id
+        async for user_id in models.Party.joined_users.through.objects.filter(
+            party_id=party_id
+        ).values_list("user_id", flat=True)
+    ]
+    await get_channel_layer().group_send(
+        LOBBY_GROUP_NAME,
+        {"type": "lobby_party_removed", "party_id": party_id, "user_ids": user_ids},
+    )
+
+
+async def party_closed(party_id: int):
+    connection = redis_client.get_connection()
+    async with connection.pipeline(transaction=True) as pipe:
+        pipe.zrem(OPEN_PARTIES_KEY, party_id)
+        pipe.hdel(PARTY_NAMES_KEY, party_id)
+        async for user_id in models.Party.joined_users.through.objects.filter(
+            party_id=party_id
+        ).values_list("user_id", flat=True):
+            pipe.zrem(get_user_parties_key(user_id), party_id)
+        await pipe.execute()
+    await get_channel_layer().group_send(
+        LOBBY_GROUP_NAME,
+        {"type": "lobby_party_removed", "party_id": party_id, "user_ids": []},
+    )
+
+
+async def rebuild_missing():
+    connection = redis_client.get_connection()
+    async with connection.lock(
+        REBUILD_LOCK_KEY,
+        timeout=REBUILD_LOCK_TIMEOUT,
+        blocking_timeout=REBUILD_LOCK_TIMEOUT,
+    ):
+        if not await connection.exists(BUILT_KEY):
+            await rebuild()
+
+
+async def rebuild():
+    """Rebuilds the whole index from the database."""
+    connection = redis_client.get_connection()
+    keys = [OPEN_PARTIES_KEY, PARTY_NAMES_KEY]
+    keys += [key async for key in connection.scan_iter(get_user_parties_key("*"))]
+    parties = models.Party.objects.filter(closed_at__isnull=True)
+    memberships = models.Party.joined_users.through.objects.filter(
+        party__closed_at__isnull=True
+    )
+    async with connection.pipeline(transaction=True) as pipe:
+        pipe.delete(*keys)
+        async for party in parties.only("id", "name", "started_at"):
+            pipe.hset(PARTY_NAMES_KEY, party.id, party.name)
+            if party.started_at is None:
+                pipe.zadd(OPEN_PARTIES_KEY, {party.id: party.id})
+        async for party_id, user_id in memberships.values_list("party_id", "user_id"):
+            pipe.zadd(get_user_parties_key(user_id), {party_id: party_id})
+        pipe.set(BUILT_KEY, 1)
+        await pipe.execute()
+    logger.info("lobby index rebuilt")
@@ -0,0 +1,73 @@
+import asyncio
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import async_db, models
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency of the party reads of core.async_db against the "
+        "ORM methods of Party, sequentially and under concurrency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("party", type=int)
+        parser.add_argument("--iterations", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=1)
+
+    def handle(self, *args, **options):
+        if async_db.AsyncConnectionPool is None:
+            raise CommandError("psycopg 3 and psycopg_pool are not installed")
+        asyncio.run(self.run(**options))
+
+    async def run(self, party, iterations, concurrency, **options):
+        party = await models.Party.objects.aget(id=party)
+        user = await get_user_model().objects.filter(parties=party).afirst()
+        if user is None:
+            raise CommandError("the party has no players")
+        queries = {
+            "current_round": (
+                party.aget_current_round,
+                lambda: async_db.fetch_current_round(party.id),
+            ),
+            "players_scores": (
+                party.aget_players_scores,
+                lambda: async_db.fetch_players_scores(party.id),
+            ),
+            "answers_for_user": (
+                lambda: party.aget_answers_for_user(user),
+                lambda: async_db.fetch_answers_for_user(party.id, user),
+            ),
+        }
+        for name, (orm_query, async_db_query) in queries.items():
+            for mode, query in (("orm", orm_query), ("async_db", async_db_query)):
+                # the first calls open the connections
+                await query()
+                latencies = await self.measure(query, iterations, concurrency)
+                self.stdout.write(
+                    f"{name:>16} {mode:>8}: "
+                    f"p50={statistics.median(latencies) * 1000:.3f}ms "
+                    f"p99={self.percentile(latencies, 0.99) * 1000:.3f}ms "
+                    f"max={max(latencies) * 1000:.3f}ms"
+                )
+
+    async def measure(self, query, iterations, concurrency):
+        latencies = []
+        pending = iter(range(iterations))
+
+        async def client():
+            for _ in pending:
+                started_at = time.perf_counter()
+                await query()
+                latencies.append(time.perf_counter() - started_at)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies
+
+    def percentile(self, values, percentile):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
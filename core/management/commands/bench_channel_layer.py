@@ -0,0 +1,100 @@
+import asyncio
+import shutil
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.channel_layers import PartyRedisChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the group traffic of several parties through one redis and "
+        "through the party shards, optionally starting local redis servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ports", default="6390,6391,6392,6393")
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument(
+            "--spawn", action="store_true", help="start a redis-server per port"
+        )
+        parser.add_argument("--parties", type=int, default=40)
+        parser.add_argument("--players", type=int, default=8)
+        parser.add_argument("--messages", type=int, default=200)
+
+    def handle(self, *args, **options):
+        ports = [int(port) for port in options["ports"].split(",")]
+        servers = self.spawn(ports) if options["spawn"] else []
+        try:
+            hosts = [f"redis://{options['host']}:{port}" for port in ports]
+            for layer_hosts in (hosts[:1], hosts):
+                elapsed, delivered = asyncio.run(self.run(layer_hosts, **options))
+                self.stdout.write(
+                    f"{len(layer_hosts)} shard(s): {delivered} messages in "
+                    f"{elapsed:.2f}s ({delivered / elapsed:.0f} msg/s)"
+                )
+        finally:
+            for server in servers:
+                server.terminate()
+
+    def spawn(self, ports):
+        if not shutil.which("redis-server"):
+            raise CommandError("redis-server is not installed")
+        servers = [
+            subprocess.Popen(
+                ["redis-server", "--port", str(port), "--save", ""],
+                stdout=subprocess.DEVNULL,
+            )
+            for port in ports
+        ]
+        time.sleep(1)
+        return servers
+
+    async def run(self, hosts, parties, players, messages, **options):
+        # group_send drops messages over the capacity, which applies to the one
+        # list shared by every socket channel of the process
+        layer = PartyRedisChannelLayer(
+            hosts=hosts, prefix="bench", capacity=parties * messages
+        )
+        try:
+            sockets = {}
+            for party_id in range(1, parties + 1):
+                sockets[party_id] = [
+                    await layer.new_channel() for _ in range(players)
+                ]
+                for channel in sockets[party_id]:
+                    await layer.group_add(f"party_{party_id}", channel)
+
+            started_at = time.perf_counter()
+            delivered = sum(
+                await asyncio.gather(
+                    *(
+                        self.run_party(layer, party_id, channels, messages)
+                        for party_id, channels in sockets.items()
+                    )
+                )
+            )
+            elapsed = time.perf_counter() - started_at
+
+            for party_id, channels in sockets.items():
+                for channel in channels:
+                    await layer.group_discard(f"party_{party_id}", channel)
+        finally:
+            await layer.flush()
+            await layer.close_pools()
+        return elapsed, delivered
+
+    async def run_party(self, layer, party_id, channels, messages):
+        async def receive(channel):
+            for _ in range(messages):
+                await layer.receive(channel)
+            return messages
+
+        receivers = [asyncio.create_task(receive(channel)) for channel in channels]
+        for index in range(messages):
+            await layer.group_send(
+                f"party_{party_id}", {"type": "html", "message": f"keystroke {index}"}
+            )
+        return sum(await asyncio.gather(*receivers))
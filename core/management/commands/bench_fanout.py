@@ -0,0 +1,85 @@
+import asyncio
+import statistics
+import time
+
+from channels_redis.pubsub import RedisPubSubChannelLayer
+from django.core.management.base import BaseCommand
+from redis import asyncio as aioredis
+
+from core.channel_layers import PartyRedisChannelLayer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the group fan-out latency and the redis cpu of the list and "
+        "the pub/sub channel layers for several group sizes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--redis", default="redis://127.0.0.1:6379")
+        parser.add_argument("--members", default="10,100,1000")
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument(
+            "--interval", type=float, default=0.02, help="seconds between messages"
+        )
+
+    def handle(self, *args, **options):
+        for size in [int(size) for size in options["members"].split(",")]:
+            for mode in ("list", "pubsub"):
+                latencies, cpu = asyncio.run(self.run(mode, size, **options))
+                self.stdout.write(
+                    f"{mode:>6} members={size:<5} "
+                    f"p50={statistics.median(latencies) * 1000:.2f}ms "
+                    f"p99={self.percentile(latencies, 0.99) * 1000:.2f}ms "
+                    f"max={max(latencies) * 1000:.2f}ms "
+                    f"redis_cpu={cpu:.3f}s"
+                )
+
+    def get_layer(self, mode, redis, messages):
+        if mode == "pubsub":
+            return RedisPubSubChannelLayer(hosts=[redis], prefix="bench")
+        # group_send drops messages over the capacity
+        return PartyRedisChannelLayer(
+            hosts=[redis], prefix="bench", capacity=messages * 2
+        )
+
+    async def run(self, mode, size, redis, messages, interval, **options):
+        layer = self.get_layer(mode, redis, messages)
+        connection = aioredis.Redis.from_url(redis)
+        group = "party_1"
+        channels = [await layer.new_channel() for _ in range(size)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+
+        latencies = []
+
+        async def receive(channel):
+            for _ in range(messages):
+                message = await layer.receive(channel)
+                latencies.append(time.perf_counter() - message["sent_at"])
+
+        receivers = [asyncio.create_task(receive(channel)) for channel in channels]
+        cpu_before = await self.get_redis_cpu(connection)
+        for _ in range(messages):
+            await layer.group_send(
+                group, {"type": "html", "sent_at": time.perf_counter()}
+            )
+            await asyncio.sleep(interval)
+        await asyncio.gather(*receivers)
+        cpu = await self.get_redis_cpu(connection) - cpu_before
+
+        for channel in channels:
+            await layer.group_discard(group, channel)
+        await layer.flush()
+        if mode == "list":
+            await layer.close_pools()
+        await connection.close()
+        return latencies, cpu
+
+    async def get_redis_cpu(self, connection):
+        info = await connection.info("cpu")
+        return info["used_cpu_sys"] + info["used_cpu_user"]
+
+    def percentile(self, values, percentile):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
@@ -0,0 +1,86 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from core import forms, models, rendering
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the event loop lag while several parties render templates, "
+        "inline and through core.rendering."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--parties", type=int, default=50)
+        parser.add_argument("--renders", type=int, default=20)
+        parser.add_argument("--players", type=int, default=8)
+
+    def handle(self, *args, **options):
+        for mode in ("inline", "pool"):
+            lags = asyncio.run(self.run(mode, **options))
+            self.stdout.write(
+                f"{mode:>6}: loop lag p50={statistics.median(lags) * 1000:.2f}ms "
+                f"p99={self.percentile(lags, 0.99) * 1000:.2f}ms "
+                f"max={max(lags) * 1000:.2f}ms"
+            )
+
+    async def run(self, mode, parties, renders, players, **options):
+        lags = []
+        stop = asyncio.Event()
+        probe = asyncio.create_task(self.probe_lag(lags, stop))
+        await asyncio.gather(
+            *(
+                self.run_party(mode, party_id, renders, players)
+                for party_id in range(1, parties + 1)
+            )
+        )
+        stop.set()
+        await probe
+        return lags
+
+    async def run_party(self, mode, party_id, renders, players):
+        context = self.get_context(party_id, players)
+        for _ in range(renders):
+            if mode == "inline":
+                render_to_string("_party_content.html", context)
+            else:
+                await rendering.render("_party_content.html", context)
+            await asyncio.sleep(0)
+
+    async def probe_lag(self, lags, stop, interval=0.005):
+        while not stop.is_set():
+            started_at = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started_at - interval)
+
+    def get_context(self, party_id, players):
+        party = models.Party(id=party_id, name=f"party {party_id}")
+        current_round = models.PartyRound(
+            id=party_id, party=party, letter="A", started_at=timezone.now()
+        )
+        answers = {
+            "letter": "A",
+            "name": "Ana",
+            "last_name": "Alvarez",
+            "country": "Argentina",
+            "city": "Armenia",
+            "animal": "Abeja",
+            "thing": "Arbol",
+            "color": "Azul",
+        }
+        return {
+            "party": party,
+            "current_round": current_round,
+            "players_scores": {f"player{i}": i * 100 for i in range(players)},
+            "rounds": [answers] * 5,
+            "form": forms.CurrentAnswersForm(current_round=current_round),
+        }
+
+    def percentile(self, values, percentile):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
@@ -0,0 +1,75 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the latency and throughput of a page served by a running "
+        "daphne, run it against the builds to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("url", help="e.g. http://localhost:8000/party/1/")
+        parser.add_argument("--sessionid", help="session cookie of a logged user")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--concurrency", type=int, default=50)
+        parser.add_argument("--htmx", action="store_true", help="send HX-Request")
+
+    def handle(self, *args, **options):
+        latencies, statuses, elapsed = asyncio.run(self.run(**options))
+        self.stdout.write(
+            f"{len(latencies)} requests in {elapsed:.2f}s "
+            f"({len(latencies) / elapsed:.1f} req/s) statuses={dict(statuses)}"
+        )
+        self.stdout.write(
+            f"latency p50={statistics.median(latencies) * 1000:.2f}ms "
+            f"p99={self.percentile(latencies, 0.99) * 1000:.2f}ms "
+            f"max={max(latencies) * 1000:.2f}ms"
+        )
+
+    async def run(self, url, sessionid, requests, concurrency, htmx, **options):
+        url = urlsplit(url)
+        headers = [
+            f"GET {url.path or '/'}{'?' + url.query if url.query else ''} HTTP/1.1",
+            f"Host: {url.netloc}",
+            "Connection: close",
+        ]
+        if sessionid:
+            headers.append(f"Cookie: sessionid={sessionid}")
+        if htmx:
+            headers.append("HX-Request: true")
+        request = ("\r\n".join(headers) + "\r\n\r\n").encode()
+
+        latencies = []
+        statuses = {}
+        pending = iter(range(requests))
+
+        async def client():
+            for _ in pending:
+                started_at = time.perf_counter()
+                status = await self.fetch(url.hostname, url.port or 80, request)
+                latencies.append(time.perf_counter() - started_at)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, statuses, time.perf_counter() - started_at
+
+    async def fetch(self, host, port, request):
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            await reader.read()
+        finally:
+            writer.close()
+        return int(status_line.split()[1])
+
+    def percentile(self, values, percentile):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percentile))]
@@ -0,0 +1,83 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import async_db, models
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the results of core.async_db with the ORM methods of Party "
+        "for every party and player."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--party", type=int, help="Only check this party.")
+
+    def handle(self, *args, **options):
+        if async_db.AsyncConnectionPool is None:
+            raise CommandError("psycopg 3 and psycopg_pool are not installed")
+        checked, mismatches = asyncio.run(self.compare(options["party"]))
+        message = f"{mismatches} mismatches in {checked} queries"
+        if mismatches:
+            raise CommandError(message)
+        self.stdout.write(self.style.SUCCESS(message))
+
+    async def compare(self, party_id):
+        parties = models.Party.objects.order_by("pk")
+        if party_id:
+            parties = parties.filter(id=party_id)
+        checked = mismatches = 0
+        async for party in parties:
+            comparisons = [
+                (
+                    "current_round",
+                    self.get_round_values(await party.aget_current_round()),
+                    self.get_round_values(
+                        await async_db.fetch_current_round(party.id)
+                    ),
+                ),
+                (
+                    "players_scores",
+                    list((await party.aget_players_scores()).items()),
+                    list((await async_db.fetch_players_scores(party.id)).items()),
+                ),
+            ]
+            async for user in party.joined_users.all():
+                for scored_rounds_only in (False, True):
+                    comparisons.append(
+                        (
+                            f"answers_for_user {user.id=} {scored_rounds_only=}",
+                            await party.aget_answers_for_user(
+                                user, scored_rounds_only=scored_rounds_only
+                            ),
+                            await async_db.fetch_answers_for_user(
+                                party.id, user, scored_rounds_only
+                            ),
+                        )
+                    )
+            for name, expected, actual in comparisons:
+                checked += 1
+                if not self.is_same(name, expected, actual):
+                    mismatches += 1
+                    self.stdout.write(
+                        f"party={party.id} {name}: orm={expected!r} "
+                        f"async_db={actual!r}"
+                    )
+        return checked, mismatches
+
+    def get_round_values(self, party_round):
+        if party_round is None:
+            return None
+        return {
+            field: getattr(party_round, field)
+            for field in async_db.CURRENT_ROUND_FIELDS
+        }
+
+    def is_same(self, name, expected, actual):
+        if name == "players_scores":
+            # players with the same score may come in any order
+            return dict(expected) == dict(actual) and [
+                score for _, score in expected
+            ] == [score for _, score in actual]
+        return expected == actual
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from core import models
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the PartyPlayerScore scoreboard with the points stored in "
+        "UserRoundAnswer, reporting the drift and optionally rebuilding it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--party", type=int, help="Only check this party.")
+        parser.add_argument(
+            "--fix", action="store_true", help="Rebuild the drifted scores."
+        )
+
+    def handle(self, *args, **options):
+        answers = models.UserRoundAnswer.objects.filter(scored_points__isnull=False)
+        scores = models.PartyPlayerScore.objects.all()
+        if options["party"]:
+            answers = answers.filter(round__party_id=options["party"])
+            scores = scores.filter(party_id=options["party"])
+
+        expected = {
+            (party_id, user_id): score
+            for party_id, user_id, score in answers.values("round__party_id", "user_id")
+            .annotate(score=Sum("scored_points"))
+            .values_list("round__party_id", "user_id", "score")
+        }
+        actual = {
+            (party_id, user_id): score
+            for party_id, user_id, score in scores.values_list(
+                "party_id", "user_id", "score"
+            )
+        }
+
+        drifted = sorted(
+            key
+            for key in expected.keys() | actual.keys()
+            if expected.get(key, 0) != actual.get(key, 0)
+        )
+        for party_id, user_id in drifted:
+            self.stdout.write(
+                f"{party_id=} {user_id=} "
+                f"expected={expected.get((party_id, user_id), 0)} "
+                f"actual={actual.get((party_id, user_id))}"
+            )
+            if options["fix"]:
+                models.PartyPlayerScore.objects.update_or_create(
+                    party_id=party_id,
+                    user_id=user_id,
+                    defaults={"score": expected.get((party_id, user_id), 0)},
+                )
+
+        message = f"{len(drifted)} drifted scores out of {len(expected)}"
+        if drifted and not options["fix"]:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -1,10 +1,94 @@
+import logging
+import multiprocessing
+import signal
+import time
+
 from channels.management.commands.runworker import Command as RunworkerCommand
+from django.core.management import CommandError
+from django.db import connections
 
 from core.routing import channel_routing
+from core.sharding import ShardedWorker
+
+logger = logging.getLogger(__name__)
+
+# Seconds the worker processes have to leave the ring before being killed.
+SHUTDOWN_TIMEOUT = 30
 
 
 class Command(RunworkerCommand):
+    worker_class = ShardedWorker
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Worker processes to run and restart when they crash, the "
+            "state machine shards are balanced between them.",
+        )
+        parser.add_argument(
+            "--uvloop", action="store_true", help="Run the workers on uvloop."
+        )
+
     def handle(self, *args, **options):
         if "*" in options["channels"]:
             options["channels"] = list(channel_routing.keys())
-        super().handle(*args, **options)
+        if options["uvloop"]:
+            try:
+                import uvloop
+            except ImportError:
+                raise CommandError("uvloop is not installed")
+            uvloop.install()
+        if options["processes"] <= 1:
+            super().handle(*args, **options)
+            return
+        self.supervise(
+            options["processes"], lambda: super(Command, self).handle(*args, **options)
+        )
+
+    def supervise(self, processes, run_worker):
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        def run_child():
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            run_worker()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        # the children are forked, none of them may share a connection
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        children = {}
+        while not stopping:
+            for index in range(processes):
+                child = children.get(index)
+                if child is not None and child.is_alive():
+                    continue
+                if child is not None:
+                    logger.warning(
+                        f"worker process {index} exited with {child.exitcode}, "
+                        "restarting it"
+                    )
+                children[index] = context.Process(
+                    target=run_child, name=f"worker-{index}"
+                )
+                children[index].start()
+            time.sleep(1)
+
+        logger.info(f"stopping {len(children)} worker processes")
+        for child in children.values():
+            if child.is_alive():
+                child.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for child in children.values():
+            child.join(max(0, deadline - time.monotonic()))
+            if child.is_alive():
+                logger.warning(f"killing {child.name}, it did not stop in time")
+                child.kill()
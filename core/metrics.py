@@ -0,0 +1,18 @@
+import collections
+
+# Process wide counters, exposed through the ``metrics`` view.
+counters = collections.Counter()
+
+
+def incr(name, value=1):
+    counters[name] += value
+
+
+def observe(name, value):
+    counters[f"{name}_count"] += 1
+    counters[f"{name}_sum"] += value
+    counters[f"{name}_max"] = max(counters[f"{name}_max"], value)
+
+
+def snapshot():
+    return dict(counters)
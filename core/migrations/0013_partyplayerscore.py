@@ -0,0 +1,45 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_scores(apps, schema_editor):
+    UserRoundAnswer = apps.get_model("core", "UserRoundAnswer")
+    PartyPlayerScore = apps.get_model("core", "PartyPlayerScore")
+    scores = (
+        UserRoundAnswer.objects.filter(scored_points__isnull=False)
+        .values("round__party_id", "user_id")
+        .annotate(score=models.Sum("scored_points"))
+        .values_list("round__party_id", "user_id", "score")
+    )
+    PartyPlayerScore.objects.bulk_create(
+        PartyPlayerScore(party_id=party_id, user_id=user_id, score=score)
+        for party_id, user_id, score in scores
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0012_party_max_round_duration_party_max_rounds_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PartyPlayerScore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.IntegerField(default=0)),
+                ('party', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='player_scores', to='core.party')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['party', '-score'], name='core_partyp_party_i_445282_idx')],
+                'unique_together': {('party', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
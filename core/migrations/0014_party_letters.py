@@ -0,0 +1,46 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:51
+
+import core.models
+from django.db import migrations, models
+
+
+def backfill_letters(apps, schema_editor):
+    # the letters already played go first, in the order they were played, so
+    # the cursor points right after them
+    Party = apps.get_model("core", "Party")
+    PartyRound = apps.get_model("core", "PartyRound")
+    for party in Party.objects.iterator():
+        played = list(
+            PartyRound.objects.filter(party_id=party.id)
+            .order_by("started_at", "id")
+            .values_list("letter", flat=True)
+        )
+        left = [
+            letter
+            for letter in core.models.get_shuffled_letters()
+            if letter not in played
+        ]
+        party.letters = "".join(played + left)
+        party.rounds_cursor = len(played)
+        party.save(update_fields=["letters", "rounds_cursor"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_partyplayerscore'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='party',
+            name='letters',
+            field=models.CharField(default=core.models.get_shuffled_letters, max_length=26),
+        ),
+        migrations.AddField(
+            model_name='party',
+            name='rounds_cursor',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_letters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_scored_at(apps, schema_editor):
+    # rounds closed until now were scored when they were closed
+    PartyRound = apps.get_model("core", "PartyRound")
+    PartyRound.objects.filter(closed_at__isnull=False).update(scored_at=F("closed_at"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_party_letters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='partyround',
+            name='scored_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_scored_at, migrations.RunPython.noop),
+    ]
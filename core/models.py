@@ -1,13 +1,13 @@
 import collections
 import random
 import string
-from collections import defaultdict
 from itertools import groupby
 
 from asgiref.sync import async_to_sync, sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils import timezone
 
 
@@ -20,6 +20,20 @@ class PartyQuerySet(models.QuerySet):
         )
 
 
+def group_answers_by_round(answers_dict):
+    answerlist = []
+    for letter, answers in groupby(answers_dict, lambda x: x["round__letter"]):
+        answerlist.append(
+            {"letter": letter}
+            | {answer["field"]: answer["value"] for answer in answers}
+        )
+    return answerlist
+
+
+def get_shuffled_letters():
+    return "".join(random.sample(string.ascii_uppercase, len(string.ascii_uppercase)))
+
+
 class Party(models.Model):
     name = models.CharField(max_length=50)
 
@@ -51,6 +65,13 @@ class Party(models.Model):
         help_text="The maximum number of rounds."
     )
 
+    # the letters of the rounds are drawn at creation, rounds_cursor is the
+    # number of them already used
+    letters = models.CharField(
+        max_length=len(string.ascii_uppercase), default=get_shuffled_letters
+    )
+    rounds_cursor = models.IntegerField(default=0)
+
     objects = PartyQuerySet.as_manager()
 
     def __str__(self):
@@ -64,23 +85,44 @@ class Party(models.Model):
         current = await self.aget_current_round()
         if current and current.closed_at is None:
             return current
-        letter = random.choice(string.ascii_uppercase)
-        parties_letters = {
-            letter
-            async for letter in PartyRound.objects.filter(party_id=self.id).values_list(
-                "letter", flat=True
-            )
-        }
-        left_letters = set(list(string.ascii_uppercase))
-        left_letters = left_letters.difference(parties_letters)
-        if not left_letters:
+        # the round after the one read, concurrent callers race for the same
+        # cursor and the losers use the round of the winner
+        cursor = self.letters.index(current.letter) + 1 if current else 0
+        next_round = await sync_to_async(self.create_round_at)(cursor)
+        if next_round is None:
+            return await self.aget_current_round()
+        return next_round
+
+    def create_round_at(self, cursor):
+        """
+        Creates the round of the letter at ``cursor``, None when another one
+        moved the cursor first.
+        """
+        if cursor >= len(self.letters):
             raise Exception("All letters are used")
-        letter = random.choice(list(left_letters))
-        return await PartyRound.objects.acreate(
-            party=self,
-            letter=letter,
-            started_at=timezone.now(),
-        )
+        with transaction.atomic(), connection.cursor() as db_cursor:
+            db_cursor.execute(
+                f"""
+                UPDATE {Party._meta.db_table}
+                SET rounds_cursor = rounds_cursor + 1
+                WHERE id = %s AND rounds_cursor = %s
+                RETURNING rounds_cursor
+                """,
+                [self.id, cursor],
+            )
+            if db_cursor.fetchone() is None:
+                return None
+            self.rounds_cursor = cursor + 1
+            return PartyRound.objects.create(
+                party=self,
+                letter=self.letters[cursor],
+                started_at=timezone.now(),
+            )
+
+    async def aget_played_rounds_count(self):
+        return await PartyRound.objects.filter(
+            party_id=self.id, closed_at__isnull=False
+        ).acount()
 
     async def aget_current_round(self):
         round = await (
@@ -91,33 +133,40 @@ class Party(models.Model):
     async def aget_players_scores(
         self,
     ):
-        points_grouped = (
-            UserRoundAnswer.objects.filter(round__party_id=self.id)
-            .values("user__username")
-            .annotate(scored_points=models.Sum("scored_points"))
-            .order_by("-scored_points")
-            .values_list("user__username", "scored_points")
+        scores = (
+            PartyPlayerScore.objects.filter(party_id=self.id)
+            .order_by("-score")
+            .values_list("user__username", "score")
         )
-        return {username: points async for username, points in points_grouped}
+        return {username: score async for username, score in scores}
 
-    async def aget_answers_for_user(self, user):
+    async def aget_answers_for_user(self, user, scored_rounds_only=False):
+        answers = UserRoundAnswer.objects.filter(
+            user_id=user.id,
+            round__party_id=self.id,
+        )
+        if scored_rounds_only:
+            answers = answers.filter(round__scored_at__isnull=False)
         answers_dict = [
             round
-            async for round in UserRoundAnswer.objects.filter(
-                user_id=user.id,
-                round__party_id=self.id,
-            ).order_by("round")
-            .values("field", "value", "round__letter")
-        ]
-
-        answerlist = []
-        for letter, answers in groupby(answers_dict, lambda x: x["round__letter"]):
-            answerlist.append(
-                {"letter": letter}
-                | {answer["field"]: answer["value"] for answer in answers}
+            async for round in answers.order_by("round").values(
+                "field", "value", "round__letter"
             )
+        ]
+        return group_answers_by_round(answers_dict)
 
-        return answerlist
+    async def aget_answers_by_user(self):
+        answers_by_user = collections.defaultdict(list)
+        async for answer in (
+            UserRoundAnswer.objects.filter(round__party_id=self.id)
+            .order_by("round")
+            .values("user_id", "field", "value", "round__letter")
+        ):
+            answers_by_user[answer["user_id"]].append(answer)
+        return {
+            user_id: group_answers_by_round(answers)
+            for user_id, answers in answers_by_user.items()
+        }
 
     get_answers_for_user = async_to_sync(aget_answers_for_user)
     get_current_or_next_round = async_to_sync(aget_current_or_next_round)
@@ -131,6 +180,9 @@ class PartyRound(models.Model):
 
     started_at = models.DateTimeField(auto_now_add=True)
     closed_at = models.DateTimeField(blank=True, null=True)
+    # set by the statement scoring it, a closed round without it is still
+    # being scored or its worker died
+    scored_at = models.DateTimeField(blank=True, null=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -140,59 +192,90 @@ class PartyRound(models.Model):
     def __str__(self):
         return f"{self.party} - {self.letter}"
 
-    async def close(self):
-        self.closed_at = timezone.now()
-        await self.asave()
-
-    async def save_user_answers(self, user, answers):
-        answers_list = []
-        for field, value in answers:
-            answers_list.append(
-                UserRoundAnswer(
-                    round=self,
-                    user=user,
-                    field=field,
-                    value=value,
-                )
+    async def acalculate_scores(self):
+        # the round was closed by the stop or the timeout that ended it
+        return await sync_to_async(self.calculate_scores)()
+
+    def calculate_scores(self):
+        # a single statement whatever the number of players, it also sets the
+        # scoreboard totals of the party, so scoring a round again changes
+        # nothing. See score_answers for the rules in python
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SCORE_ROUND_SQL.format(
+                    rounds_table=PartyRound._meta.db_table,
+                    answers_table=UserRoundAnswer._meta.db_table,
+                    users_table=get_user_model()._meta.db_table,
+                    scores_table=PartyPlayerScore._meta.db_table,
+                ),
+                {
+                    "round_id": self.id,
+                    "party_id": self.party_id,
+                    "letter": self.letter.lower(),
+                },
             )
-        await UserRoundAnswer.objects.abulk_create(
-            answers_list,
-            update_conflicts=True,
-            update_fields=["value"],
-            unique_fields=["round", "user", "field"],
-        )
-
-    async def close_round_and_calculate_scores(self):
-        await self.close()
-
-        answers_to_save = []
-        answers_by_field = collections.defaultdict(list)
-        async for answer in UserRoundAnswer.objects.filter(round=self):
-            answers_by_field[answer.field].append(answer)
-
-        for field, answers in answers_by_field.items():
-            all_users_for_field_answers = defaultdict(int)
-            for answer in answers:
-                all_users_for_field_answers[answer.value] += 1
-
-            for answer in answers:
-                if not answer.value:
-                    answers_to_save.append(answer)
-                    continue
-                if not answer.value.lower().startswith(self.letter.lower()):
-                    answers_to_save.append(answer)
-                    continue
-                answer.scored_points = 100 // all_users_for_field_answers[answer.value]
-                answers_to_save.append(answer)
-
-        await UserRoundAnswer.objects.abulk_update(answers_to_save, ["scored_points"])
-        return answers_to_save
-
-    async def aget_initial_data_for_user(self, user):
-        return {
-            answer.field: answer.value
-            async for answer in UserRoundAnswer.objects.filter(round=self, user=user)
-        }
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+SCORE_ROUND_SQL = """
+WITH scored AS (
+    UPDATE {answers_table} AS answer
+    SET scored_points = CASE
+        WHEN left(lower(answer.value), 1) = %(letter)s THEN 100 / counted.duplicates
+    END
+    FROM (
+        SELECT
+            id,
+            COUNT(*) OVER (PARTITION BY field, lower(value)) AS duplicates
+        FROM {answers_table}
+        WHERE round_id = %(round_id)s
+    ) AS counted, {users_table} AS player
+    WHERE answer.id = counted.id AND player.id = answer.user_id
+    RETURNING
+        answer.user_id,
+        answer.field,
+        answer.value,
+        answer.scored_points,
+        player.username
+), scoreboard AS (
+    -- the other CTEs see the answers as they were before the UPDATE, the
+    -- points of this round come from scored and the rest from the table
+    INSERT INTO {scores_table} (party_id, user_id, score)
+    SELECT %(party_id)s, points.user_id, COALESCE(SUM(points.scored_points), 0)
+    FROM (
+        SELECT user_id, scored_points FROM scored
+        UNION ALL
+        SELECT answer.user_id, answer.scored_points
+        FROM {answers_table} AS answer
+        JOIN {rounds_table} AS party_round ON party_round.id = answer.round_id
+        WHERE party_round.party_id = %(party_id)s
+            AND answer.round_id <> %(round_id)s
+    ) AS points
+    GROUP BY points.user_id
+    ON CONFLICT (party_id, user_id)
+    DO UPDATE SET score = EXCLUDED.score
+), marked AS (
+    UPDATE {rounds_table} SET scored_at = clock_timestamp() WHERE id = %(round_id)s
+)
+SELECT field, value, scored_points, username FROM scored
+"""
+
+
+def score_answers(letter, answers):
+    """
+    Reference implementation of ``SCORE_ROUND_SQL``, ``answers`` are
+    ``(field, value)`` pairs and the points are returned in the same order.
+    """
+    duplicates = collections.Counter(
+        (field, value.lower()) for field, value in answers
+    )
+    return [
+        100 // duplicates[field, value.lower()]
+        if value and value.lower().startswith(letter.lower())
+        else None
+        for field, value in answers
+    ]
 
 
 class UserRoundAnswer(models.Model):
@@ -229,3 +312,19 @@ class UserRoundAnswer(models.Model):
 
     def __str__(self):
         return f"{self.round} - {self.user} - {self.field} - {self.value}"
+
+
+class PartyPlayerScore(models.Model):
+    party = models.ForeignKey(
+        Party, on_delete=models.CASCADE, related_name="player_scores"
+    )
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("party", "user")
+        indexes = [models.Index(fields=["party", "-score"])]
+
+    def __str__(self):
+        return f"{self.party} - {self.user} - {self.score}"
@@ -0,0 +1,44 @@
+"""
+Rendered party fragments cached per party version.
+
+Every party has a version in redis that the state machine bumps after each
+transition, once the database reflects it. Fragments are cached under the
+current version so page reloads and reconnects during a round are served from
+redis, and a bump makes every older fragment unreachable until it expires.
+"""
+from django.conf import settings
+
+from core import metrics, redis_client, rendering
+
+
+def get_version_key(party_id: int) -> str:
+    return f"party_cache:version:{party_id}"
+
+
+def get_fragment_key(
+    party_id: int, version: int, user_id: int, template_name: str
+) -> str:
+    return f"party_cache:{party_id}:{version}:{user_id}:{template_name}"
+
+
+async def bump(party_id: int):
+    connection = redis_client.get_connection(party_id)
+    await connection.incr(get_version_key(party_id))
+
+
+async def get_or_render(party_id, user_id, template_name, get_context) -> str:
+    """
+    Returns the fragment cached for the current version of the party or
+    renders it with the context returned by the ``get_context`` coroutine.
+    """
+    connection = redis_client.get_connection(party_id)
+    version = await connection.get(get_version_key(party_id)) or 0
+    key = get_fragment_key(party_id, version, user_id, template_name)
+    fragment = await connection.get(key)
+    if fragment is not None:
+        metrics.incr("party_fragment_cache_hits")
+        return fragment
+    metrics.incr("party_fragment_cache_misses")
+    fragment = await rendering.render(template_name, await get_context())
+    await connection.set(key, fragment, ex=settings.PARTY_FRAGMENT_CACHE_TTL)
+    return fragment
@@ -0,0 +1,43 @@
+"""
+Makes sure only one ``event_party_started`` is sent and handled per party.
+
+The first player connecting to a party that did not start yet takes a lease
+and signals the state machine, everybody else goes straight to the join path.
+The lease outlives the time the state machine waits for players, when it
+expires the next connect signals again in case the first one was lost.
+
+The state machine claims the join phase the same way, instead of locking the
+party row while it waits for the players.
+"""
+from core import metrics, redis_client
+
+
+def get_start_lease_key(party_id: int) -> str:
+    return f"party_start:lease:{party_id}"
+
+
+def get_join_claim_key(party_id: int) -> str:
+    return f"party_start:join:{party_id}"
+
+
+async def claim_start_signal(party, lease_seconds: int) -> bool:
+    if party.started_at:
+        metrics.incr("party_start_signals_suppressed")
+        return False
+    connection = redis_client.get_connection(party.id)
+    claimed = await connection.set(
+        get_start_lease_key(party.id), 1, nx=True, ex=lease_seconds
+    )
+    if not claimed:
+        metrics.incr("party_start_signals_suppressed")
+        return False
+    metrics.incr("party_start_signals_sent")
+    return True
+
+
+async def claim_join(party_id: int, claim_seconds: int) -> bool:
+    connection = redis_client.get_connection(party_id)
+    claimed = await connection.set(
+        get_join_claim_key(party_id), 1, nx=True, ex=claim_seconds
+    )
+    return bool(claimed)
@@ -0,0 +1,49 @@
+"""
+Players connected to each party.
+
+Every socket is a member of a per party sorted set scored with the time its
+presence expires. Sockets refresh it while connected, so a socket dying
+without disconnecting is dropped once its ttl passes. The whole party lives
+in a single key, counting it is a cheap prune plus a read of its members.
+"""
+import time
+
+from django.conf import settings
+
+from core import redis_client
+
+
+def get_presence_key(party_id: int) -> str:
+    return f"presence:{party_id}"
+
+
+def get_member(user_id: int, channel_name: str) -> str:
+    return f"{user_id}:{channel_name}"
+
+
+async def touch(party_id: int, user_id: int, channel_name: str):
+    connection = redis_client.get_connection(party_id)
+    key = get_presence_key(party_id)
+    async with connection.pipeline(transaction=False) as pipe:
+        pipe.zadd(
+            key,
+            {get_member(user_id, channel_name): time.time() + settings.PRESENCE_TTL},
+        )
+        pipe.expire(key, int(settings.PRESENCE_TTL))
+        await pipe.execute()
+
+
+async def leave(party_id: int, user_id: int, channel_name: str):
+    connection = redis_client.get_connection(party_id)
+    await connection.zrem(get_presence_key(party_id), get_member(user_id, channel_name))
+
+
+async def count(party_id: int) -> int:
+    """Players connected to the party, however many sockets each one has open."""
+    connection = redis_client.get_connection(party_id)
+    key = get_presence_key(party_id)
+    async with connection.pipeline(transaction=True) as pipe:
+        pipe.zremrangebyscore(key, "-inf", time.time())
+        pipe.zrange(key, 0, -1)
+        _, members = await pipe.execute()
+    return len({member.split(":", 1)[0] for member in members})
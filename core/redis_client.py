@@ -0,0 +1,39 @@
+import asyncio
+import weakref
+
+from django.conf import settings
+from redis import asyncio as aioredis
+
+# redis.asyncio clients are bound to the event loop that created them, so keep
+# one per loop like channels_redis does for the channel layer.
+_connections = weakref.WeakKeyDictionary()
+
+
+def get_shard_index(party_id: int, shards: int) -> int:
+    """
+    Shard of everything about a party, shared by the channel layer and these
+    connections so the traffic of a party stays on one redis.
+    """
+    return int(party_id) % shards
+
+
+def get_connections() -> list[aioredis.Redis]:
+    """Connections to every shard, for the keys a worker polls on all of them."""
+    loop = asyncio.get_running_loop()
+    if loop not in _connections:
+        _connections[loop] = [
+            aioredis.Redis.from_url(url, decode_responses=True)
+            for url in settings.REDIS_URLS
+        ]
+    return _connections[loop]
+
+
+def get_connection(party_id: int | None = None) -> aioredis.Redis:
+    """
+    Connection to the redis shard of the party. Keys shared by every party,
+    the lobby and the registry of workers, live in the first one.
+    """
+    connections = get_connections()
+    if party_id is None:
+        return connections[0]
+    return connections[get_shard_index(party_id, len(connections))]
@@ -0,0 +1,46 @@
+"""
+Template rendering off the event loop.
+
+``render_to_string`` is CPU bound, running it inside a consumer stalls every
+other party handled by the same worker. Templates are rendered on a bounded
+thread pool instead, using the cached template loader Django enables by
+default.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from core import metrics
+
+_executor = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.TEMPLATE_RENDER_WORKERS,
+            thread_name_prefix="render",
+        )
+    return _executor
+
+
+def _render(template_name, context, queued_at):
+    metrics.incr("render_queue_depth", -1)
+    metrics.observe("render_wait_seconds", time.perf_counter() - queued_at)
+    started_at = time.perf_counter()
+    try:
+        return render_to_string(template_name, context)
+    finally:
+        metrics.observe("render_seconds", time.perf_counter() - started_at)
+
+
+async def render(template_name: str, context: dict | None = None) -> str:
+    loop = asyncio.get_running_loop()
+    metrics.incr("render_queue_depth")
+    return await loop.run_in_executor(
+        get_executor(), _render, template_name, context, time.perf_counter()
+    )
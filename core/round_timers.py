@@ -0,0 +1,79 @@
+"""
+Round deadlines kept in a redis sorted set.
+
+Every running round has a member scored with its deadline in the set of the
+redis shard of its party. Any state machine worker polls the due members of
+every shard and the one removing a member sends its event,
+``event_round_timeout`` by default, to the shard of the party. A timer fires
+at most once and survives the worker that scheduled it.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+from core import redis_client, sharding
+
+logger = logging.getLogger(__name__)
+
+TIMERS_KEY = "round_timers"
+POLL_BATCH_SIZE = 100
+
+
+def get_timer_member(event_type: str, party_id: int, round_id: int) -> str:
+    return f"{event_type}:{party_id}:{round_id}"
+
+
+async def schedule(
+    party_id: int,
+    round_id: int,
+    deadline: float,
+    event_type: str = "event_round_timeout",
+):
+    connection = redis_client.get_connection(party_id)
+    await connection.zadd(
+        TIMERS_KEY, {get_timer_member(event_type, party_id, round_id): deadline}
+    )
+
+
+async def cancel(
+    party_id: int, round_id: int, event_type: str = "event_round_timeout"
+):
+    connection = redis_client.get_connection(party_id)
+    await connection.zrem(TIMERS_KEY, get_timer_member(event_type, party_id, round_id))
+
+
+async def fire_due_timers(channel_layer, connection) -> int:
+    due = await connection.zrangebyscore(
+        TIMERS_KEY, "-inf", time.time(), start=0, num=POLL_BATCH_SIZE
+    )
+    fired = 0
+    for member in due:
+        if not await connection.zrem(TIMERS_KEY, member):
+            continue
+        event_type, party_id, round_id = member.split(":")
+        logger.info(f"firing {event_type} {party_id=} {round_id=}")
+        await channel_layer.send(
+            sharding.get_state_machine_channel_name(party_id),
+            {
+                "type": event_type,
+                "party_id": int(party_id),
+                "round_id": int(round_id),
+            },
+        )
+        fired += 1
+    return fired
+
+
+async def poll(channel_layer):
+    while True:
+        wait = settings.ROUND_TIMERS_POLL_INTERVAL
+        for connection in redis_client.get_connections():
+            if await fire_due_timers(channel_layer, connection) == POLL_BATCH_SIZE:
+                wait = 0
+                continue
+            next_timer = await connection.zrange(TIMERS_KEY, 0, 0, withscores=True)
+            if next_timer:
+                wait = min(wait, max(0, next_timer[0][1] - time.time()))
+        await asyncio.sleep(wait)
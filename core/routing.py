@@ -1,11 +1,15 @@
 from django.urls import path
 
-from . import consumers
+from . import consumers, sharding
 
 websocket_urlpatterns = [
+    path("lobby/", consumers.LobbyConsumer.as_asgi()),
     path("party/<int:party_id>/", consumers.PartyConsumer.as_asgi()),
 ]
 
+party_state_machine = consumers.PartyStateMachine.as_asgi()
+
 channel_routing = {
-    "party-state-machine": consumers.PartyStateMachine.as_asgi(),
+    channel: party_state_machine
+    for channel in sharding.get_state_machine_channel_names()
 }
\ No newline at end of file
@@ -0,0 +1,196 @@
+"""
+Spreads the party state machine over several channels and workers.
+
+Every party belongs to one of ``STATE_MACHINE_SHARDS`` channels, and every
+shard channel is listened to by a single live worker chosen with rendezvous
+hashing over the workers heartbeating in redis. Shards are rebalanced when a
+worker joins or leaves, and the parties run by a worker that stopped
+heartbeating in the middle of a transition are restarted on the owners of
+their shards. A worker stopping gracefully waits for its transitions in flight
+and hands over the rest right away. Every worker also fires the due round
+timers and flushes the buffered answers.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+
+from channels.worker import Worker
+from django.conf import settings
+
+from core import answer_buffer, redis_client, round_timers
+
+logger = logging.getLogger(__name__)
+
+STATE_MACHINE_CHANNEL_PREFIX = "party-state-machine"
+WORKERS_KEY = "state_machine:workers"
+
+# Set by the ShardedWorker running in this process.
+current_worker_id = None
+
+# Transitions in flight of every state machine instance of this process.
+party_tasks = set()
+
+
+def get_state_machine_channel_names() -> list[str]:
+    return [
+        f"{STATE_MACHINE_CHANNEL_PREFIX}.{shard}"
+        for shard in range(settings.STATE_MACHINE_SHARDS)
+    ]
+
+
+def get_state_machine_channel_name(party_id: int) -> str:
+    shard = int(party_id) % settings.STATE_MACHINE_SHARDS
+    return f"{STATE_MACHINE_CHANNEL_PREFIX}.{shard}"
+
+
+def get_worker_parties_key(worker_id: str) -> str:
+    return f"state_machine:worker:{worker_id}:parties"
+
+
+def get_shard_owner(channel: str, worker_ids: list[str]) -> str:
+    return max(
+        worker_ids,
+        key=lambda worker_id: hashlib.md5(f"{worker_id}:{channel}".encode()).digest(),
+    )
+
+
+# Transitions of the same party may overlap, a party stays registered until
+# the last of them is done.
+UNREGISTER_PARTY_SCRIPT = """
+if redis.call("HINCRBY", KEYS[1], ARGV[1], -1) <= 0 then
+    redis.call("HDEL", KEYS[1], ARGV[1])
+end
+"""
+
+
+async def register_party(party_id: int):
+    if current_worker_id:
+        connection = redis_client.get_connection()
+        await connection.hincrby(get_worker_parties_key(current_worker_id), party_id)
+
+
+async def unregister_party(party_id: int):
+    if current_worker_id:
+        connection = redis_client.get_connection()
+        await connection.eval(
+            UNREGISTER_PARTY_SCRIPT,
+            1,
+            get_worker_parties_key(current_worker_id),
+            party_id,
+        )
+
+
+async def drain_party_tasks(timeout: float):
+    """
+    Waits up to ``timeout`` for the transitions in flight. The ones still
+    running are left alone, cancelling them would unregister their parties
+    before they are recovered.
+    """
+    if not party_tasks:
+        return
+    logger.info(f"waiting for {len(party_tasks)} party transitions in flight")
+    _, pending = await asyncio.wait(set(party_tasks), timeout=timeout)
+    if pending:
+        logger.warning(f"{len(pending)} party transitions left to the recovery")
+
+
+class ShardedWorker(Worker):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.worker_id = "%s-%s-%s" % (
+            socket.gethostname(),
+            os.getpid(),
+            uuid.uuid4().hex[:8],
+        )
+        self.shard_listeners = {}
+
+    def run(self):
+        # a loop of its own, from the policy so uvloop can be used, and a
+        # stop on SIGTERM or SIGINT that leaves the ring and hands over the
+        # parties in flight instead of waiting for the heartbeat to expire
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        handle = loop.create_task(self.handle())
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, handle.cancel)
+        loop.create_task(self.application_checker())
+        try:
+            loop.run_until_complete(handle)
+        except asyncio.CancelledError:
+            logger.info(f"worker {self.worker_id} stopped")
+
+    async def handle(self):
+        global current_worker_id
+        current_worker_id = self.worker_id
+        shards = set(get_state_machine_channel_names())
+        tasks = [
+            asyncio.ensure_future(self.listener(channel))
+            for channel in self.channels
+            if channel not in shards
+        ]
+        tasks.append(
+            asyncio.ensure_future(self.heartbeat(shards.intersection(self.channels)))
+        )
+        tasks.append(asyncio.ensure_future(round_timers.poll(self.channel_layer)))
+        tasks.append(asyncio.ensure_future(answer_buffer.flush_periodically()))
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            [task.result() for task in tasks if task.done()]
+        finally:
+            for task in [*tasks, *self.shard_listeners.values()]:
+                task.cancel()
+            await redis_client.get_connection().zrem(WORKERS_KEY, self.worker_id)
+            await drain_party_tasks(settings.STATE_MACHINE_DRAIN_TIMEOUT)
+            # answers buffered by the sockets of this process
+            await answer_buffer.flush_pending_rounds()
+            await self.recover_parties(self.worker_id)
+
+    async def heartbeat(self, shards):
+        connection = redis_client.get_connection()
+        logger.info(f"worker {self.worker_id} joining for {len(shards)} shards")
+        while True:
+            now = time.time()
+            await connection.zadd(WORKERS_KEY, {self.worker_id: now})
+            for worker_id in await connection.zrangebyscore(
+                WORKERS_KEY, "-inf", now - settings.STATE_MACHINE_HEARTBEAT_TIMEOUT
+            ):
+                # only the worker removing it recovers its parties
+                if await connection.zrem(WORKERS_KEY, worker_id):
+                    await self.recover_parties(worker_id)
+            worker_ids = await connection.zrange(WORKERS_KEY, 0, -1)
+            self.rebalance(
+                {
+                    shard
+                    for shard in shards
+                    if get_shard_owner(shard, worker_ids) == self.worker_id
+                }
+            )
+            await asyncio.sleep(settings.STATE_MACHINE_HEARTBEAT_INTERVAL)
+
+    def rebalance(self, owned_shards):
+        for shard in set(self.shard_listeners) - owned_shards:
+            logger.info(f"worker {self.worker_id} releasing {shard}")
+            self.shard_listeners.pop(shard).cancel()
+        for shard in owned_shards - set(self.shard_listeners):
+            logger.info(f"worker {self.worker_id} listening on {shard}")
+            self.shard_listeners[shard] = asyncio.ensure_future(self.listener(shard))
+
+    async def recover_parties(self, worker_id):
+        connection = redis_client.get_connection()
+        parties_key = get_worker_parties_key(worker_id)
+        for party_id in await connection.hkeys(parties_key):
+            logger.info(f"restarting {party_id=} of dead worker {worker_id}")
+            await self.channel_layer.send(
+                get_state_machine_channel_name(party_id),
+                {
+                    "type": "event_party_started",
+                    "party_id": int(party_id),
+                    "force_start": True,
+                },
+            )
+        await connection.delete(parties_key)
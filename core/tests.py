@@ -1,3 +1,1117 @@
-from django.test import TestCase
+import asyncio
+import collections
+import itertools
+import json
+import string
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import F
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.utils import timezone
+from redis import asyncio as aioredis
+
+from core import (
+    answer_buffer,
+    answers_snapshot,
+    async_db,
+    consumers,
+    db_slots,
+    lobby,
+    models,
+    party_cache,
+    party_start,
+    presence,
+    ratelimit,
+    redis_client,
+    round_timers,
+    sharding,
+)
+
+# core's keys of the tests live in a database of their own, flushed by each test
+TEST_REDIS_URLS = [f"{host}/15" for host in settings.REDIS_HOSTS]
+
+IN_MEMORY_CHANNEL_LAYERS = {
+    "default": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+    "pubsub": {"BACKEND": "channels.layers.InMemoryChannelLayer"},
+}
+
+
+@override_settings(REDIS_URLS=TEST_REDIS_URLS)
+class RedisTestCase(TestCase):
+    def setUp(self):
+        super().setUp()
+        async_to_sync(self.flush_redis)()
+
+    async def flush_redis(self):
+        for url in settings.REDIS_URLS:
+            connection = aioredis.Redis.from_url(url)
+            await connection.flushdb()
+            await connection.close()
+
+    async def redis(self, command, *args, shard=0):
+        url = settings.REDIS_URLS[shard]
+        connection = aioredis.Redis.from_url(url, decode_responses=True)
+        try:
+            return await getattr(connection, command)(*args)
+        finally:
+            await connection.close()
+
+
+class PartyTestMixin:
+    def create_party(self, players=2, **kwargs):
+        kwargs.setdefault("min_players", players)
+        kwargs.setdefault("letters", string.ascii_uppercase)
+        party = models.Party.objects.create(name="party", **kwargs)
+        self.players = [
+            User.objects.create(username=f"player{index}") for index in range(players)
+        ]
+        party.joined_users.add(*self.players)
+        return party
+
+    def create_round(self, party, letter="A", **kwargs):
+        models.Party.objects.filter(id=party.id).update(
+            rounds_cursor=F("rounds_cursor") + 1
+        )
+        return models.PartyRound.objects.create(
+            party=party, letter=letter, started_at=timezone.now(), **kwargs
+        )
+
+
+class AnswerBufferTests(PartyTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.party = self.create_party()
+        self.round = self.create_round(self.party)
+
+    def get_answers(self):
+        return dict(
+            models.UserRoundAnswer.objects.filter(round=self.round).values_list(
+                "field", "value"
+            )
+        )
+
+    async def get_buffered_rounds(self):
+        return await self.redis("smembers", answer_buffer.PENDING_ROUNDS_KEY)
+
+    def test_flush_stores_the_buffered_answers(self):
+        user = self.players[0]
+        async_to_sync(answer_buffer.buffer_user_answers)(
+            self.party.id,
+            self.round.id,
+            user.id,
+            [("name", "Ana"), ("city", "Amsterdam")],
+        )
+        async_to_sync(answer_buffer.buffer_user_answers)(
+            self.party.id, self.round.id, user.id, [("name", "Andres")]
+        )
+        self.assertEqual(self.get_answers(), {})
+
+        flushed = async_to_sync(answer_buffer.flush_round)(self.party.id, self.round.id)
+
+        self.assertEqual(flushed, 2)
+        self.assertEqual(self.get_answers(), {"name": "Andres", "city": "Amsterdam"})
+        self.assertEqual(async_to_sync(self.get_buffered_rounds)(), set())
+
+    def test_pending_rounds_are_flushed_by_any_worker(self):
+        # buffered by a process that died before flushing them
+        async_to_sync(answer_buffer.buffer_user_answers)(
+            self.party.id, self.round.id, self.players[0].id, [("animal", "Ant")]
+        )
+        self.assertEqual(
+            async_to_sync(self.get_buffered_rounds)(),
+            {answer_buffer.get_pending_member(self.party.id, self.round.id)},
+        )
+
+        async_to_sync(answer_buffer.flush_pending_rounds)()
+
+        self.assertEqual(self.get_answers(), {"animal": "Ant"})
+        self.assertEqual(async_to_sync(self.get_buffered_rounds)(), set())
+
+    def test_closing_flush_rejects_later_answers(self):
+        user = self.players[0]
+        async_to_sync(answer_buffer.buffer_user_answers)(
+            self.party.id, self.round.id, user.id, [("name", "Ana")]
+        )
+        async_to_sync(answer_buffer.flush_round)(
+            self.party.id, self.round.id, close=True
+        )
+
+        buffered = async_to_sync(answer_buffer.buffer_user_answers)(
+            self.party.id, self.round.id, user.id, [("name", "Alberto")]
+        )
+        async_to_sync(answer_buffer.flush_pending_rounds)()
+
+        self.assertFalse(buffered)
+        self.assertEqual(self.get_answers(), {"name": "Ana"})
+
+
+@override_settings(REDIS_URLS=[f"{settings.REDIS_HOSTS[0]}/{db}" for db in (14, 15)])
+class RedisShardsTests(PartyTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.parties = [self.create_party()]
+        self.parties.append(models.Party.objects.create(name="other party"))
+        self.parties.sort(key=lambda party: party.id % 2)
+
+    def test_answers_are_buffered_on_the_shard_of_the_party(self):
+        party = self.parties[1]
+        party_round = self.create_round(party)
+        async_to_sync(answer_buffer.buffer_user_answers)(
+            party.id, party_round.id, self.players[0].id, [("name", "Ana")]
+        )
+        for shard, buffered in enumerate([set(), {f"{party.id}:{party_round.id}"}]):
+            self.assertEqual(
+                async_to_sync(self.redis)(
+                    "smembers", answer_buffer.PENDING_ROUNDS_KEY, shard=shard
+                ),
+                buffered,
+            )
+
+        async_to_sync(answer_buffer.flush_pending_rounds)()
+
+        self.assertTrue(
+            models.UserRoundAnswer.objects.filter(
+                round=party_round, value="Ana"
+            ).exists()
+        )
+
+    def test_due_timers_fire_from_every_shard(self):
+        channel_layer = mock.AsyncMock()
+        for party in self.parties:
+            async_to_sync(round_timers.schedule)(party.id, party.id, time.time() - 1)
+        for shard, party in enumerate(self.parties):
+            member = round_timers.get_timer_member(
+                "event_round_timeout", party.id, party.id
+            )
+            self.assertEqual(
+                async_to_sync(self.redis)(
+                    "zrange", round_timers.TIMERS_KEY, 0, -1, shard=shard
+                ),
+                [member],
+            )
+
+        async def fire():
+            return [
+                await round_timers.fire_due_timers(channel_layer, connection)
+                for connection in redis_client.get_connections()
+            ]
+
+        self.assertEqual(async_to_sync(fire)(), [1, 1])
+        self.assertEqual(
+            sorted(call.args[1]["party_id"] for call in channel_layer.send.mock_calls),
+            sorted(party.id for party in self.parties),
+        )
+
+
+class ScoreRoundTests(PartyTestMixin, TestCase):
+    """SCORE_ROUND_SQL against its python reference, score_answers."""
+
+    def setUp(self):
+        self.party = self.create_party(players=3)
+
+    def score(self, letter, answers_by_player):
+        party_round = self.create_round(self.party, letter=letter)
+        answers = [
+            (self.players[index], field, value)
+            for index, player_answers in enumerate(answers_by_player)
+            for field, value in player_answers.items()
+        ]
+        models.UserRoundAnswer.objects.bulk_create(
+            models.UserRoundAnswer(
+                round=party_round, user=user, field=field, value=value
+            )
+            for user, field, value in answers
+        )
+        expected = models.score_answers(
+            letter, [(field, value) for _, field, value in answers]
+        )
+        return party_round, {
+            (user.username, field): points
+            for (user, field, _), points in zip(answers, expected)
+        }
+
+    def get_points(self, rows):
+        return {(row["username"], row["field"]): row["scored_points"] for row in rows}
+
+    def assert_matches_reference(self, letter, answers_by_player):
+        party_round, expected = self.score(letter, answers_by_player)
+        self.assertEqual(self.get_points(party_round.calculate_scores()), expected)
+        stored = {
+            (answer.user.username, answer.field): answer.scored_points
+            for answer in party_round.userroundanswer_set.select_related("user")
+        }
+        self.assertEqual(stored, expected)
+        return expected
+
+    def test_mixed_case_duplicates_share_the_points(self):
+        expected = self.assert_matches_reference(
+            "A", [{"name": "Ana"}, {"name": "ANA"}, {"name": "aNa"}]
+        )
+        self.assertEqual(set(expected.values()), {33})
+
+    def test_duplicates_are_counted_per_field(self):
+        expected = self.assert_matches_reference(
+            "A",
+            [
+                {"name": "Alba", "city": "Amsterdam"},
+                {"name": "Alba", "city": "Alba"},
+                {"name": "Andres", "city": "Amsterdam"},
+            ],
+        )
+        self.assertEqual(expected["player0", "name"], 50)
+        self.assertEqual(expected["player1", "city"], 100)
+        self.assertEqual(expected["player2", "name"], 100)
+
+    def test_empty_values_score_nothing(self):
+        expected = self.assert_matches_reference(
+            "A", [{"name": "", "city": "Asuncion"}, {"name": ""}, {"name": "Ana"}]
+        )
+        self.assertIsNone(expected["player0", "name"])
+        self.assertIsNone(expected["player1", "name"])
+        self.assertEqual(expected["player2", "name"], 100)
+
+    def test_values_not_starting_with_the_letter_score_nothing(self):
+        expected = self.assert_matches_reference(
+            "B",
+            [{"name": "Ana", "color": "blue"}, {"name": "Ana"}, {"name": " Beto"}],
+        )
+        self.assertIsNone(expected["player0", "name"])
+        self.assertIsNone(expected["player2", "name"])
+        self.assertEqual(expected["player0", "color"], 100)
+
+    def test_scoring_again_gives_the_same_points(self):
+        party_round, expected = self.score(
+            "A", [{"name": "Ana", "animal": "Ant"}, {"name": "ana"}, {"animal": "x"}]
+        )
+        first = self.get_points(party_round.calculate_scores())
+        second = self.get_points(party_round.calculate_scores())
+        self.assertEqual(first, expected)
+        self.assertEqual(second, expected)
+
+    def get_scoreboard(self):
+        return dict(self.party.player_scores.values_list("user__username", "score"))
+
+    def test_scoreboard_adds_up_the_rounds_once(self):
+        first_round, _ = self.score("A", [{"name": "Ana"}, {"name": "Alba"}, {}])
+        second_round, _ = self.score(
+            "B", [{"name": "Beto"}, {"name": "beto"}, {"name": "Ana"}]
+        )
+
+        first_round.calculate_scores()
+        second_round.calculate_scores()
+        self.assertEqual(
+            self.get_scoreboard(), {"player0": 150, "player1": 150, "player2": 0}
+        )
+
+        # a resumed stop scores a round again
+        second_round.calculate_scores()
+        first_round.calculate_scores()
+        self.assertEqual(
+            self.get_scoreboard(), {"player0": 150, "player1": 150, "player2": 0}
+        )
+
+
+@skipUnless(async_db.AsyncConnectionPool, "psycopg 3 is not installed")
+@override_settings(ASYNC_DB_ENABLED=True)
+class AsyncDbParityTests(PartyTestMixin, TransactionTestCase):
+    """
+    The psycopg pool reads against the ORM methods they replace. The pool has
+    connections of its own, so the data is committed instead of kept in the
+    transaction of a TestCase.
+    """
+
+    maxDiff = None
+
+    def setUp(self):
+        self.party = self.create_party()
+        self.empty_party = models.Party.objects.create(name="empty party")
+        scored_round = self.create_round(
+            self.party, closed_at=timezone.now(), scored_at=timezone.now()
+        )
+        closed_round = self.create_round(
+            self.party, letter="B", closed_at=timezone.now()
+        )
+        current_round = self.create_round(self.party, letter="C")
+        models.UserRoundAnswer.objects.bulk_create(
+            models.UserRoundAnswer(
+                round=party_round, user=user, field=field, value=value
+            )
+            for party_round, value in [
+                (scored_round, "Ana"),
+                (closed_round, "Bea"),
+                (current_round, "Cid"),
+            ]
+            for user in self.players
+            for field in ["name", "city"]
+        )
+        for score, user in enumerate(self.players):
+            models.PartyPlayerScore.objects.create(
+                party=self.party, user=user, score=score
+            )
+
+    async def test_reads_match_the_orm(self):
+        pool = await async_db.get_pool()
+        try:
+            for party in [self.party, self.empty_party]:
+                await self.assert_party_reads_match(party)
+        finally:
+            await pool.close()
+
+    def get_round_values(self, party_round):
+        if party_round is None:
+            return None
+        return [getattr(party_round, field) for field in async_db.CURRENT_ROUND_FIELDS]
+
+    async def assert_party_reads_match(self, party):
+        self.assertEqual(
+            self.get_round_values(await async_db.fetch_current_round(party.id)),
+            self.get_round_values(await party.aget_current_round()),
+        )
+        self.assertEqual(
+            list((await async_db.fetch_players_scores(party.id)).items()),
+            list((await party.aget_players_scores()).items()),
+        )
+        for user in self.players:
+            for scored_rounds_only in [False, True]:
+                self.assertEqual(
+                    await async_db.fetch_answers_for_user(
+                        party.id, user, scored_rounds_only
+                    ),
+                    await party.aget_answers_for_user(user, scored_rounds_only),
+                )
+
+
+class LetterCursorTests(PartyTestMixin, TestCase):
+    def close(self, party_round):
+        party_round.closed_at = timezone.now()
+        party_round.save(update_fields=["closed_at"])
+
+    def test_rounds_follow_the_letters_of_the_party(self):
+        party = self.create_party(letters="XYZ")
+        letters = []
+        for _ in range(3):
+            party_round = party.get_current_or_next_round()
+            # an open round is returned until it is closed
+            self.assertEqual(party.get_current_or_next_round().id, party_round.id)
+            self.close(party_round)
+            letters.append(party_round.letter)
+
+        self.assertEqual(letters, ["X", "Y", "Z"])
+        party.refresh_from_db()
+        self.assertEqual(party.rounds_cursor, 3)
+        with self.assertRaisesMessage(Exception, "All letters are used"):
+            party.get_current_or_next_round()
+
+    def test_a_moved_cursor_creates_no_round(self):
+        party = self.create_party(letters="XYZ")
+        party.get_current_or_next_round()
+
+        self.assertIsNone(party.create_round_at(0))
+        self.assertEqual(party.partyround_set.count(), 1)
+
+
+class ConcurrentNextRoundTests(PartyTestMixin, TransactionTestCase):
+    def test_concurrent_calls_share_the_next_round(self):
+        party = self.create_party(letters="XYZ")
+        barrier = threading.Barrier(2, timeout=10)
+        reads = itertools.count()
+        read_current_round = models.Party.aget_current_round
+
+        async def aget_current_round(party):
+            current_round = await read_current_round(party)
+            if next(reads) < 2:
+                # both callers saw no open round before claiming the next one
+                await sync_to_async(barrier.wait, thread_sensitive=False)()
+            return current_round
+
+        round_ids = []
+
+        def next_round():
+            try:
+                round_ids.append(
+                    models.Party.objects.get(id=party.id).get_current_or_next_round().id
+                )
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=next_round) for _ in range(2)]
+        with mock.patch.object(models.Party, "aget_current_round", aget_current_round):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(round_ids), 2)
+        self.assertEqual(len(set(round_ids)), 1)
+        party.refresh_from_db()
+        self.assertEqual(party.rounds_cursor, 1)
+        self.assertEqual(party.partyround_set.count(), 1)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@mock.patch("core.sharding.current_worker_id", "test-worker")
+class PartyStateMachineTests(PartyTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.party = self.create_party(started_at=timezone.now(), max_rounds=2)
+        self.state_machine = consumers.PartyStateMachine()
+
+    def save_answers(self, party_round, user, **answers):
+        models.UserRoundAnswer.objects.bulk_create(
+            models.UserRoundAnswer(
+                round=party_round, user=user, field=field, value=value
+            )
+            for field, value in answers.items()
+        )
+
+    async def get_timers(self):
+        return await self.redis("zrange", round_timers.TIMERS_KEY, 0, -1)
+
+    async def get_registered_parties(self):
+        return await self.redis(
+            "hgetall", sharding.get_worker_parties_key("test-worker")
+        )
+
+    def get_scores(self):
+        return dict(
+            models.PartyPlayerScore.objects.filter(party=self.party).values_list(
+                "user__username", "score"
+            )
+        )
+
+    def test_end_round_scores_and_schedules_the_reveal(self):
+        party_round = self.create_round(self.party, letter="A")
+        self.save_answers(party_round, self.players[0], name="Ana", city="Bogota")
+        self.save_answers(party_round, self.players[1], name="ana")
+
+        async_to_sync(self.state_machine.end_round)(self.party.id, party_round.id)
+
+        party_round.refresh_from_db()
+        self.assertIsNotNone(party_round.closed_at)
+        self.assertIsNotNone(party_round.scored_at)
+        self.assertEqual(self.get_scores(), {"player0": 50, "player1": 50})
+        self.assertEqual(
+            async_to_sync(self.get_timers)(),
+            [
+                round_timers.get_timer_member(
+                    "event_reveal_finished", self.party.id, party_round.id
+                )
+            ],
+        )
+        self.assertEqual(async_to_sync(self.get_registered_parties)(), {})
+
+    def test_end_round_flushes_and_publishes_the_answers_once(self):
+        party_round = self.create_round(self.party, letter="A")
+        async_to_sync(answer_buffer.buffer_user_answers)(
+            self.party.id, party_round.id, self.players[0].id, [("name", "Ana")]
+        )
+
+        with mock.patch.object(
+            answer_buffer, "flush_round", wraps=answer_buffer.flush_round
+        ) as flush_round, mock.patch.object(
+            answers_snapshot, "publish", wraps=answers_snapshot.publish
+        ) as publish:
+            async_to_sync(self.state_machine.end_round)(self.party.id, party_round.id)
+
+        flush_round.assert_called_once_with(self.party.id, party_round.id, close=True)
+        publish.assert_called_once()
+        self.assertEqual(self.get_scores(), {"player0": 100})
+
+    def test_only_the_first_stop_scores_the_round(self):
+        party_round = self.create_round(self.party, letter="A")
+        self.save_answers(party_round, self.players[0], name="Ana")
+
+        async def stop_twice():
+            await asyncio.gather(
+                self.state_machine.end_round(self.party.id, party_round.id),
+                self.state_machine.end_round(self.party.id, party_round.id),
+            )
+
+        async_to_sync(stop_twice)()
+
+        self.assertEqual(self.get_scores(), {"player0": 100})
+        self.assertEqual(async_to_sync(self.get_registered_parties)(), {})
+
+    def test_recovery_scores_a_round_closed_by_a_dead_worker(self):
+        party_round = self.create_round(
+            self.party, letter="A", closed_at=timezone.now()
+        )
+        self.save_answers(party_round, self.players[0], name="Ana")
+
+        async_to_sync(self.state_machine.start_party)(
+            {"party_id": self.party.id, "force_start": True}
+        )
+
+        party_round.refresh_from_db()
+        self.assertIsNotNone(party_round.scored_at)
+        self.assertEqual(self.get_scores(), {"player0": 100})
+        self.assertEqual(models.PartyRound.objects.filter(party=self.party).count(), 1)
+        self.assertEqual(
+            async_to_sync(self.get_timers)(),
+            [
+                round_timers.get_timer_member(
+                    "event_reveal_finished", self.party.id, party_round.id
+                )
+            ],
+        )
+
+    def test_recovery_starts_the_next_round_of_a_scored_round(self):
+        self.create_round(
+            self.party, letter="A", closed_at=timezone.now(), scored_at=timezone.now()
+        )
+
+        async_to_sync(self.state_machine.start_party)(
+            {"party_id": self.party.id, "force_start": True}
+        )
+
+        next_round = models.PartyRound.objects.filter(party=self.party).latest(
+            "started_at"
+        )
+        self.assertIsNone(next_round.closed_at)
+        self.assertEqual(
+            async_to_sync(self.get_timers)(),
+            [
+                round_timers.get_timer_member(
+                    "event_round_timeout", self.party.id, next_round.id
+                )
+            ],
+        )
+
+    def test_reveal_finished_starts_the_next_round(self):
+        party_round = self.create_round(
+            self.party, letter="A", closed_at=timezone.now(), scored_at=timezone.now()
+        )
+
+        async def reveal_finished():
+            with mock.patch.object(
+                sharding, "register_party", wraps=sharding.register_party
+            ) as register_party:
+                await self.state_machine.event_reveal_finished(
+                    {"party_id": self.party.id, "round_id": party_round.id}
+                )
+                await asyncio.gather(*self.state_machine.party_tasks)
+            register_party.assert_called_once_with(self.party.id)
+
+        async_to_sync(reveal_finished)()
+
+        self.assertEqual(models.PartyRound.objects.filter(party=self.party).count(), 2)
+        self.assertEqual(async_to_sync(self.get_registered_parties)(), {})
+
+    def test_advance_closes_the_party_after_the_last_round(self):
+        for letter in "AB":
+            self.create_round(
+                self.party,
+                letter=letter,
+                closed_at=timezone.now(),
+                scored_at=timezone.now(),
+            )
+
+        async_to_sync(self.state_machine.advance)(self.party)
+
+        self.party.refresh_from_db()
+        self.assertIsNotNone(self.party.closed_at)
+        self.assertEqual(models.PartyRound.objects.filter(party=self.party).count(), 2)
+
+    def test_a_party_without_duration_starts_rounds_without_timeout(self):
+        self.party.max_round_duration = None
+        self.party.save(update_fields=["max_round_duration"])
+
+        async_to_sync(self.state_machine.advance)(self.party)
+
+        self.assertEqual(models.PartyRound.objects.filter(party=self.party).count(), 1)
+        self.assertEqual(async_to_sync(self.get_timers)(), [])
+
+    def test_a_single_state_machine_waits_for_the_players(self):
+        models.Party.objects.filter(id=self.party.id).update(started_at=None)
+        waiting = asyncio.Event()
+        joined = asyncio.Event()
+
+        async def ensure_players_join(party):
+            waiting.set()
+            await joined.wait()
+
+        async def start_twice():
+            first = asyncio.create_task(
+                self.state_machine.wait_players_to_join(self.party.id)
+            )
+            await waiting.wait()
+            # the first one is still waiting, without any lock on the party
+            second = await self.state_machine.wait_players_to_join(self.party.id)
+            joined.set()
+            return await first, second
+
+        with mock.patch.object(
+            self.state_machine, "ensure_players_join", ensure_players_join
+        ):
+            party, second = async_to_sync(start_twice)()
+
+        self.assertEqual(party.id, self.party.id)
+        self.assertIsNone(second)
+        self.party.refresh_from_db()
+        self.assertEqual(self.party.started_at, party.started_at)
+
+
+class DrainPartyTasksTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(sharding, "party_tasks", set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_transitions_in_flight_are_awaited(self):
+        finished = asyncio.Event()
+
+        async def transition():
+            await asyncio.sleep(0.01)
+            finished.set()
+
+        sharding.party_tasks.add(asyncio.create_task(transition()))
+        await sharding.drain_party_tasks(timeout=1)
+
+        self.assertTrue(finished.is_set())
+
+    async def test_slow_transitions_are_left_running(self):
+        task = asyncio.create_task(asyncio.sleep(1))
+        sharding.party_tasks.add(task)
+
+        await sharding.drain_party_tasks(timeout=0.01)
+
+        # cancelling it would unregister the party before it is recovered
+        self.assertFalse(task.done())
+        task.cancel()
+
+
+class LobbyTests(PartyTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.party = self.create_party()
+        self.client.force_login(self.players[0])
+
+    def test_a_missing_index_is_rebuilt_by_the_first_read(self):
+        parties, next_cursor = async_to_sync(lobby.get_page)(self.players[0].id)
+
+        self.assertEqual(parties, [{"id": self.party.id, "name": "party"}])
+        self.assertIsNone(next_cursor)
+
+    def test_a_malformed_cursor_reads_the_first_page(self):
+        for before in ["abc", "", "1.5"]:
+            response = self.client.get(
+                "/home/", {"before": before}, HTTP_HX_REQUEST="true"
+            )
+            self.assertContains(response, f"lobby_party_{self.party.id}")
+
+    def test_the_cursor_reads_older_parties(self):
+        response = self.client.get(
+            "/home/", {"before": self.party.id}, HTTP_HX_REQUEST="true"
+        )
+        self.assertNotContains(response, f"lobby_party_{self.party.id}")
+
+
+class PartyViewsTests(PartyTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.party = self.create_party(started_at=timezone.now())
+        self.client.force_login(self.players[0])
+
+    def test_a_started_party_renders_its_content(self):
+        self.create_round(self.party, letter="C")
+        models.PartyPlayerScore.objects.create(
+            party=self.party, user=self.players[1], score=7
+        )
+
+        response = self.client.get(f"/party/{self.party.id}/", HTTP_HX_REQUEST="true")
+
+        self.assertContains(response, "<h3>C</h3>", html=True)
+        self.assertContains(response, "player1")
+
+    def test_the_party_content_is_cached_until_the_party_changes(self):
+        self.create_round(self.party, letter="C")
+        self.client.get(f"/party/{self.party.id}/", HTTP_HX_REQUEST="true")
+        self.create_round(self.party, letter="D")
+
+        response = self.client.get(f"/party/{self.party.id}/", HTTP_HX_REQUEST="true")
+        self.assertContains(response, "<h3>C</h3>", html=True)
+
+        async_to_sync(party_cache.bump)(self.party.id)
+
+        response = self.client.get(f"/party/{self.party.id}/", HTTP_HX_REQUEST="true")
+        self.assertContains(response, "<h3>D</h3>", html=True)
+
+    def test_reading_the_party_starts_no_round(self):
+        self.client.get(f"/party/{self.party.id}/", HTTP_HX_REQUEST="true")
+
+        self.assertFalse(models.PartyRound.objects.filter(party=self.party).exists())
+
+    def get_answers(self, **headers):
+        return self.client.get(
+            f"/party/{self.party.id}/user/player1/answers",
+            HTTP_HX_REQUEST="true",
+            **headers,
+        )
+
+    def create_scored_round(self, letter="A"):
+        now = timezone.now()
+        return self.create_round(
+            self.party, letter=letter, closed_at=now, scored_at=now
+        )
+
+    def test_answers_are_not_modified_for_a_matching_etag(self):
+        self.create_scored_round()
+        response = self.get_answers()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("HX-Request", response["Vary"])
+        self.assertIn("private", response["Cache-Control"])
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        cached = self.get_answers(HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached["ETag"], response["ETag"])
+
+    def test_scoring_a_round_changes_the_etag(self):
+        self.create_scored_round()
+        etag = self.get_answers()["ETag"]
+        party_round = self.create_round(
+            self.party, letter="B", closed_at=timezone.now()
+        )
+        models.UserRoundAnswer.objects.create(
+            round=party_round, user=self.players[1], field="name", value="Bea"
+        )
+
+        # closed, its buffered answers are not stored and scored yet
+        response = self.get_answers(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.get_answers()
+        self.assertNotContains(response, "Bea")
+
+        party_round.calculate_scores()
+
+        response = self.get_answers(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertContains(response, "Bea")
+
+    def test_partial_and_full_pages_have_their_own_etags(self):
+        partial = self.get_answers()
+        full = self.client.get(
+            f"/party/{self.party.id}/user/player1/answers",
+            HTTP_IF_NONE_MATCH=partial["ETag"],
+        )
+
+        self.assertEqual(full.status_code, 200)
+        self.assertNotEqual(full["ETag"], partial["ETag"])
+
+
+@override_settings(DATABASE_HTTP_SLOTS=1)
+class DatabaseSlotsMiddlewareTests(SimpleTestCase):
+    async def test_http_requests_wait_for_a_slot(self):
+        running = []
+        release = asyncio.Event()
+
+        async def app(scope, receive, send):
+            running.append(scope["type"])
+            await release.wait()
+
+        middleware = db_slots.DatabaseSlotsMiddleware(app)
+        requests = [
+            asyncio.create_task(middleware({"type": scope_type}, None, None))
+            for scope_type in ["http", "http", "websocket"]
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(running, ["http", "websocket"])
+
+        release.set()
+        await asyncio.gather(*requests)
+        self.assertEqual(running, ["http", "websocket", "http"])
+
+
+class TokenBucketTests(SimpleTestCase):
+    @mock.patch("core.ratelimit.time.monotonic", return_value=100.0)
+    def test_burst_then_rate(self, monotonic):
+        bucket = ratelimit.TokenBucket(rate=2, burst=3)
+
+        self.assertEqual([bucket.consume() for _ in range(4)], [True] * 3 + [False])
+        self.assertEqual(bucket.get_wait_time(), 0.5)
+
+        monotonic.return_value = 100.5
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+        # never over the burst however long the socket was idle
+        monotonic.return_value = 1000.0
+        self.assertEqual([bucket.consume() for _ in range(4)], [True] * 3 + [False])
+
+
+class PresenceTests(RedisTestCase):
+    def test_players_are_counted_once_whatever_their_sockets(self):
+        for user_id, channel_name in [(1, "tab1"), (1, "tab2"), (2, "tab3")]:
+            async_to_sync(presence.touch)(1, user_id, channel_name)
+        self.assertEqual(async_to_sync(presence.count)(1), 2)
+
+        # still connected through the other tab
+        async_to_sync(presence.leave)(1, 1, "tab1")
+        self.assertEqual(async_to_sync(presence.count)(1), 2)
+
+        async_to_sync(presence.leave)(1, 1, "tab2")
+        self.assertEqual(async_to_sync(presence.count)(1), 1)
+
+    def test_sockets_not_refreshed_are_dropped(self):
+        async_to_sync(presence.touch)(1, 1, "tab1")
+
+        with mock.patch(
+            "core.presence.time.time",
+            return_value=time.time() + settings.PRESENCE_TTL + 1,
+        ):
+            self.assertEqual(async_to_sync(presence.count)(1), 0)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PartyConsumerTests(PartyTestMixin, RedisTestCase):
+    def setUp(self):
+        super().setUp()
+        self.party = self.create_party(started_at=timezone.now())
+        self.round = self.create_round(self.party, letter="A")
+
+    def get_consumer(self):
+        consumer = consumers.PartyConsumer()
+        consumer.scope = {"user": self.players[0]}
+        consumer.party_id = self.party.id
+        consumer.party = self.party
+        consumer.current_round = self.round
+        consumer.stats = collections.Counter()
+        consumer.send = mock.AsyncMock()
+        return consumer
+
+    def get_sent(self, consumer):
+        sent = [call.kwargs["text_data"] for call in consumer.send.call_args_list]
+        consumer.send.reset_mock()
+        return sent
+
+    async def connect(self, consumer):
+        consumer.scope["url_route"] = {"kwargs": {"party_id": self.party.id}}
+        consumer.channel_layer = get_channel_layer()
+        consumer.channel_name = await consumer.channel_layer.new_channel()
+        consumer.accept = mock.AsyncMock()
+        await consumer.connect()
+        consumer.presence_task.cancel()
+        await asyncio.gather(consumer.presence_task, return_exceptions=True)
+
+    def test_only_the_fields_whose_errors_changed_are_sent(self):
+        consumer = self.get_consumer()
+        submit = async_to_sync(consumer.handle_form_submit)
+
+        submit({"name": "Bea", "city": "Amsterdam"})
+        [message] = self.get_sent(consumer)
+        self.assertEqual(message.count('hx-swap-oob="true"'), 1)
+        self.assertIn('id="answer_field_name"', message)
+        self.assertIn("no empieza por", message)
+
+        # the error of the name was already sent
+        submit({"name": "Bea", "city": "Amsterdam", "animal": "Ant"})
+        self.assertEqual(self.get_sent(consumer), [])
+
+        submit({"name": "Ana", "city": "Amsterdam", "animal": "Ant"})
+        [message] = self.get_sent(consumer)
+        self.assertEqual(message.count('hx-swap-oob="true"'), 1)
+        self.assertIn('id="answer_field_name"', message)
+        self.assertNotIn("no empieza por", message)
+        self.assertEqual(consumer.stats["answers_form_submits"], 3)
+        self.assertEqual(consumer.stats["answers_fragments_sent"], 2)
+
+    def test_a_reconnect_reads_the_current_round(self):
+        self.round.closed_at = timezone.now()
+        self.round.save(update_fields=["closed_at"])
+        next_round = self.create_round(self.party, letter="B")
+        consumer = self.get_consumer()
+        consumer.current_round = None
+
+        async_to_sync(self.connect)(consumer)
+
+        self.assertEqual(consumer.current_round.id, next_round.id)
+        self.assertTrue(consumer.party_is_available())
+
+    def test_events_of_older_rounds_are_ignored(self):
+        next_round = self.create_round(self.party, letter="B")
+        consumer = self.get_consumer()
+        consumer.current_round = next_round
+
+        async_to_sync(consumer.event_party_new_round)(
+            {"round": consumer.serialize_round(self.round), "message": "A"}
+        )
+        self.assertEqual(consumer.current_round, next_round)
+        self.get_sent(consumer)
+
+        async_to_sync(consumer.event_party_round_stopped)(
+            {"round_id": self.round.id, "answers_key": "party_answers:0:stale"}
+        )
+        self.assertEqual(self.get_sent(consumer), [])
+        self.assertTrue(consumer.party_is_available())
+
+    def test_a_stop_of_a_missed_round_reads_it_from_the_database(self):
+        next_round = self.create_round(self.party, letter="B")
+        models.UserRoundAnswer.objects.create(
+            round=next_round, user=self.players[0], field="name", value="Bea"
+        )
+        answers_key = async_to_sync(answers_snapshot.publish)(self.party)
+        consumer = self.get_consumer()
+
+        async_to_sync(consumer.event_party_round_stopped)(
+            {"round_id": next_round.id, "answers_key": answers_key}
+        )
+
+        self.assertEqual(consumer.current_round.id, next_round.id)
+        self.assertFalse(consumer.party_is_available())
+        [message] = self.get_sent(consumer)
+        self.assertIn('value="Bea"', message)
+
+    def test_only_the_first_connect_signals_the_start(self):
+        models.Party.objects.filter(id=self.party.id).update(started_at=None)
+        queues = mock.AsyncMock()
+
+        def connect_players():
+            for player in self.players:
+                consumer = self.get_consumer()
+                consumer.scope["user"] = player
+                async_to_sync(self.connect)(consumer)
+            return [
+                call.args[0]
+                for call in queues.send.call_args_list
+                if call.args[1].get("type") == "event_party_started"
+            ]
+
+        with mock.patch.object(
+            consumers.PartyConsumer, "get_queues_channel_layer", return_value=queues
+        ):
+            self.assertEqual(
+                connect_players(),
+                [sharding.get_state_machine_channel_name(self.party.id)],
+            )
+            # the signal was lost, the next connect after the lease sends it again
+            async_to_sync(self.redis)(
+                "delete", party_start.get_start_lease_key(self.party.id)
+            )
+            self.assertEqual(len(connect_players()), 2)
+
+            models.Party.objects.filter(id=self.party.id).update(
+                started_at=timezone.now()
+            )
+            async_to_sync(self.redis)(
+                "delete", party_start.get_start_lease_key(self.party.id)
+            )
+            self.assertEqual(len(connect_players()), 2)
+
+
+class PartyConsumerFramesTests(SimpleTestCase):
+    def setUp(self):
+        self.consumer = consumers.PartyConsumer()
+        self.consumer.stats = collections.Counter()
+        self.consumer.rate_limit = ratelimit.TokenBucket(rate=20, burst=1)
+        self.consumer.pending_frame = None
+        self.consumer.pending_frame_task = None
+        self.consumer.frame_lock = asyncio.Lock()
+        self.handled = []
+
+        async def handle_form_submit(data):
+            self.handled.append(data["name"])
+
+        self.consumer.handle_form_submit = handle_form_submit
+
+    async def receive(self, name, **data):
+        data["name"] = name
+        data["HEADERS"] = {"HX-Trigger": "party_current_answers_form"}
+        await self.consumer.receive(json.dumps(data))
+
+    async def wait_pending_frame(self):
+        if self.consumer.pending_frame_task:
+            await self.consumer.pending_frame_task
+
+    async def test_frames_over_the_limit_are_coalesced_into_the_latest(self):
+        for name in ["A", "An", "Ana", "Anab"]:
+            await self.receive(name)
+        self.assertEqual(self.handled, ["A"])
+
+        await self.wait_pending_frame()
+
+        self.assertEqual(self.handled, ["A", "Anab"])
+        self.assertEqual(self.consumer.stats["frames_coalesced"], 3)
+        self.assertEqual(self.consumer.stats["frames_dropped"], 2)
+
+    async def test_newer_frames_never_overtake_the_parked_one(self):
+        await self.receive("A")
+        await self.receive("An")
+        # a token is back before the parked frame wakes up
+        self.consumer.rate_limit.tokens = 1
+        await self.receive("Ana")
+        self.assertEqual(self.handled, ["A"])
+
+        await self.wait_pending_frame()
+
+        self.assertEqual(self.handled, ["A", "Ana"])
+
+    async def test_stop_drops_the_parked_frame(self):
+        await self.receive("A")
+        await self.receive("An")
+        await self.receive("Ana", submit_stop="true")
+        self.assertEqual(self.handled, ["A", "Ana"])
+
+        await self.wait_pending_frame()
+
+        self.assertEqual(self.handled, ["A", "Ana"])
+
+    async def test_a_frame_parked_while_handling_the_parked_one_is_handled(self):
+        handling = asyncio.Event()
+        release = asyncio.Event()
+
+        async def handle_form_submit(data):
+            self.handled.append(data["name"])
+            if data["name"] == "An":
+                handling.set()
+                await release.wait()
+
+        self.consumer.handle_form_submit = handle_form_submit
+        await self.receive("A")
+        await self.receive("An")
+        await handling.wait()
+        await self.receive("Ana")
+        release.set()
+
+        await self.wait_pending_frame()
+
+        self.assertEqual(self.handled, ["A", "An", "Ana"])
+        self.assertIsNone(self.consumer.pending_frame_task)
+
+    async def test_disconnect_stores_the_parked_frame(self):
+        self.consumer.party_id = 1
+        self.consumer.party_group_name = "party_1"
+        self.consumer.scope = {"user": mock.Mock(username="player0")}
+        self.consumer.channel_layer = mock.AsyncMock()
+        self.consumer.channel_name = "socket"
+        self.consumer.presence_task = None
+        await self.receive("A")
+        await self.receive("An")
+
+        await self.consumer.disconnect(1000)
+
+        self.assertEqual(self.handled, ["A", "An"])
+        self.assertIsNone(self.consumer.pending_frame)
+
+    @override_settings(PARTY_SOCKET_COALESCE=False)
+    async def test_frames_over_the_limit_are_dropped_without_coalescing(self):
+        await self.receive("A")
+        await self.receive("An")
+        await self.wait_pending_frame()
+
+        self.assertEqual(self.handled, ["A"])
+        self.assertEqual(self.consumer.stats["frames_dropped"], 1)
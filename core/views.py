@@ -1,17 +1,37 @@
 import logging
 
-from asgiref.sync import async_to_sync
+from asgiref.sync import async_to_sync, sync_to_async
 from channels.layers import get_channel_layer
 from django.contrib import messages
 from django.contrib.auth import login
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import (
+    AccessMixin,
+    LoginRequiredMixin,
+    UserPassesTestMixin,
+)
 from django.contrib.auth.models import User
-from django.http import Http404
+from django.db.models import Exists, Max, OuterRef, Q
+from django.http import Http404, JsonResponse
 from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from django.utils.safestring import mark_safe
 from django.views import View
 from django.views.generic.base import ContextMixin, TemplateResponseMixin
 
-from core import forms, models
+from core import (
+    async_db,
+    forms,
+    lobby,
+    metrics,
+    models,
+    party_cache,
+    presence,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +46,33 @@ class HTMXPartialMixin(ContextMixin, TemplateResponseMixin):
         return context
 
 
+class AsyncLoginRequiredMixin(AccessMixin):
+    """
+    LoginRequiredMixin for async views, the user is loaded from the session
+    in a thread once and cached in the request.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        if not await sync_to_async(lambda: request.user.is_authenticated)():
+            return self.handle_no_permission()
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class LobbyMixin:
+    def get_lobby_context(self):
+        try:
+            before = int(self.request.GET["before"])
+        except (KeyError, ValueError):
+            # a missing or malformed cursor reads the first page
+            before = None
+        parties, next_cursor = async_to_sync(lobby.get_page)(
+            self.request.user.id, before=before
+        )
+        return {"parties": parties, "next_cursor": next_cursor}
+
+
 class Login(
+    LobbyMixin,
     HTMXPartialMixin,
     View,
 ):
@@ -45,30 +91,29 @@ class Login(
         login(request, user)
         # TODO: try a redirect
         context = self.get_context_data(**kwargs)
-        context["parties"] = models.Party.objects.all()
+        context.update(self.get_lobby_context())
         return self.render_to_response(context)
 
 
 class Home(
     LoginRequiredMixin,
+    LobbyMixin,
     HTMXPartialMixin,
     View,
 ):
-    template_name = "home.html"
-
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        context["parties"] = models.Party.objects.get_available_parties(
-            self.request.user
-        )
-        return context
+    def get_template_names(self):
+        # next pages of the lobby
+        if self.request.htmx and "before" in self.request.GET:
+            return ["_lobby_page.html"]
+        return ["home.html"]
 
     def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
+        context.update(self.get_lobby_context())
         return self.render_to_response(context)
 
 
-class CreateParty(LoginRequiredMixin, HTMXPartialMixin, View):
+class CreateParty(LoginRequiredMixin, LobbyMixin, HTMXPartialMixin, View):
     form_saved = False
 
     def get_template_names(self):
@@ -100,13 +145,12 @@ class CreateParty(LoginRequiredMixin, HTMXPartialMixin, View):
             name=form.cleaned_data["name"], defaults=form.cleaned_data
         )
         if created:
+            async_to_sync(lobby.party_created)(party)
             messages.add_message(
                 request, messages.SUCCESS, f"'{party.name}' created successfully."
             )
 
-        context["parties"] = models.Party.objects.get_available_parties(
-            self.request.user
-        )
+        context.update(self.get_lobby_context())
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.send)(
             "party_state_machine",
@@ -121,29 +165,55 @@ class CreateParty(LoginRequiredMixin, HTMXPartialMixin, View):
         )
 
 
-class DetailParty(LoginRequiredMixin, HTMXPartialMixin, View):
+class DetailParty(AsyncLoginRequiredMixin, HTMXPartialMixin, View):
     template_name = "party_no_started.html"
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        party_qs = models.Party.objects.filter(id=kwargs["party_id"]) & (
-            models.Party.objects.filter(joined_users__pk=self.request.user.id)
-            | models.Party.objects.filter(
-                closed_at__isnull=True,
-            )
+    async def aget_party(self, party_id):
+        joined = models.Party.joined_users.through.objects.filter(
+            party_id=OuterRef("pk"), user_id=self.request.user.id
         )
-        party_qs = party_qs.order_by("pk").distinct("pk")
-        if not party_qs.exists():
+        party = await models.Party.objects.filter(
+            Q(closed_at__isnull=True) | Exists(joined), id=party_id
+        ).afirst()
+        if party is None:
             raise Http404()
+        return party
 
-        context["party"] = party_qs.get()
-        self.party = context["party"]
-        context["current_round"] = self.party.get_current_or_next_round()
-        context["players_scores"] = self.party.get_players_scores()
-        context["rounds"] = self.party.get_answers_for_user(self.request.user)
-        context["form"] = forms.CurrentAnswersForm(
-            current_round=context["current_round"],
-        )
+    async def aget_content_context(self):
+        # awaited one by one: the ORM fallbacks all run on the one sync thread
+        # of the request, and gathering them from behind sync middleware under
+        # daphne deadlocks on that thread
+        current_round = await async_db.get_current_round(self.party.id)
+        players_scores = await async_db.get_players_scores(self.party.id)
+        rounds = await async_db.get_answers_for_user(self.party.id, self.request.user)
+        # reading the page never starts a round, the state machine does
+        disabled = current_round is None or current_round.closed_at is not None
+        return {
+            "party": self.party,
+            "current_round": current_round,
+            "players_scores": players_scores,
+            "rounds": rounds,
+            "disabled": disabled,
+            "form": current_round
+            and forms.CurrentAnswersForm(
+                current_round=current_round, disabled=disabled
+            ),
+        }
+
+    async def aget_context_data(self, *args, **kwargs):
+        context = self.get_context_data(*args, **kwargs)
+        self.party = context["party"] = await self.aget_party(kwargs["party_id"])
+        if self.party.started_at:
+            context["party_content"] = mark_safe(
+                await party_cache.get_or_render(
+                    self.party.id,
+                    self.request.user.id,
+                    "_party_content.html",
+                    self.aget_content_context,
+                )
+            )
+        else:
+            context["connected_players"] = await presence.count(self.party.id)
         return context
 
     def get_template_names(self):
@@ -151,29 +221,74 @@ class DetailParty(LoginRequiredMixin, HTMXPartialMixin, View):
             return ["party.html"]
         return ["party_no_started.html"]
 
-    def get(self, request, *args, **kwargs):
-        context = self.get_context_data(**kwargs)
+    async def get(self, request, *args, **kwargs):
+        context = await self.aget_context_data(**kwargs)
         return self.render_to_response(context)
 
 
-class PartyAnswers(LoginRequiredMixin, HTMXPartialMixin, View):
+class PartyAnswers(AsyncLoginRequiredMixin, HTMXPartialMixin, View):
     template_name = "party_modal_answers.html"
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        party_qs = models.Party.objects.filter(id=kwargs["party_id"]) & (
-            models.Party.objects.filter(joined_users__pk=self.request.user.id)
+    async def aget_party(self, party_id):
+        party = await (
+            models.Party.objects.filter(
+                id=party_id, joined_users__pk=self.request.user.id
+            )
+            .annotate(last_scored_round_at=Max("partyround__scored_at"))
+            .afirst()
         )
-        party_qs = party_qs.order_by("pk").distinct("pk")
-        if not party_qs.exists():
+        if party is None:
+            raise Http404()
+        return party
+
+    async def aget_user(self, username):
+        try:
+            return await User.objects.aget(username=username)
+        except User.DoesNotExist:
             raise Http404()
 
-        context["party"] = party_qs.get()
-        user = User.objects.get(username=kwargs["username"])
-        context["rounds"] = context["party"].get_answers_for_user(user)
+    async def aget_context_data(self, party, *args, **kwargs):
+        context = self.get_context_data(*args, **kwargs)
+        context["party"] = party
+        user = await self.aget_user(kwargs["username"])
+        context["rounds"] = await async_db.get_answers_for_user(
+            party.id, user, scored_rounds_only=True
+        )
         context["open"] = "open"
         return context
 
+    def get_etag(self, party):
+        # the answers of scored rounds never change, a new scored round is the
+        # only way for the table to change. A closed round is left out until
+        # its buffered answers are stored and scored
+        last_scored_round_at = party.last_scored_round_at
+        version = last_scored_round_at.timestamp() if last_scored_round_at else 0
+        partial = "partial" if self.request.htmx else "full"
+        return quote_etag(f"{party.id}-{version}-{partial}")
+
+    async def get(self, request, *args, **kwargs):
+        party = await self.aget_party(kwargs["party_id"])
+        etag = self.get_etag(party)
+        last_modified = party.last_scored_round_at and int(
+            party.last_scored_round_at.timestamp()
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            context = await self.aget_context_data(party, **kwargs)
+            response = self.render_to_response(context)
+        response["ETag"] = etag
+        if last_modified:
+            response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["HX-Request"])
+        return response
+
+
+class Metrics(LoginRequiredMixin, UserPassesTestMixin, View):
+    def test_func(self):
+        return self.request.user.is_staff
+
     def get(self, request, *args, **kwargs):
-        context = self.get_context_data(**kwargs)
-        return self.render_to_response(context)
+        return JsonResponse(metrics.snapshot())